@@ -2,6 +2,7 @@
 Code to analyze a mooring extraction in relation to processes that affect bottom pressure.
 """
 
+import sys
 import xarray as xr
 import numpy as np
 import gsw
@@ -14,6 +15,13 @@ from lo_tools import plotting_functions as pfun
 # set mooring extraction to analyze (just needs salt, temp, and zeta)
 Ldir = Lfun.Lstart()
 
+pth = Ldir['parent'] / 'LPM' / 'misc'
+if str(pth) not in sys.path:
+    sys.path.append(str(pth))
+import lp_fun
+# where low-passed fields are cached, see lp_fun.py
+cache_dir = Ldir['parent'] / 'LPM_output' / 'lp_cache'
+
 out_dir = Ldir['parent'] / 'LPM_output' / 'bpress'
 Lfun.make_dir(out_dir)
 
@@ -29,6 +37,22 @@ def icb(ax, cs):
     cb = fig.colorbar(cs, cax=cbaxes, orientation='vertical')
     cb.ax.tick_params(labelsize=.85*fs)
 
+def get_eos(ds):
+    """
+    Equation of state calculations, returning SA, CT, and rho stacked
+    on a last axis, packed (NT, N, 3).
+    """
+    zw = ds.z_w.values
+    Z = ds.z_rho.values.mean(axis=0) - zw.mean(axis=0)[-1]
+    p = gsw.p_from_z(Z, ds.lat_rho.values)
+    SA = gsw.SA_from_SP(ds.salt.values, p, ds.lon_rho.values, ds.lat_rho.values) # absolute salinity
+    CT = gsw.CT_from_pt(SA, ds.temp.values) # conservative temperature
+    rho = gsw.rho(SA, CT, p)
+    # This is denser than ROMS rho by 0.037 [kg m-3] at the bottom and 0.0046 [kg m-3]
+    # (annual averages), and it is the full density, not density minus 1000.
+    # There was no visual difference between the pressure time series.
+    return np.stack((SA, CT, rho), axis=-1)
+
 plt.close('all')
 for sn in sn_list:
 
@@ -45,16 +69,12 @@ for sn in sn_list:
     g = 9.81 # gravity [m s-2]
     rho0 = 1025 # reference density [kg m-3]
 
-    # pull fields from dataset
+    # pull the small fields from dataset (the big ones are read below, only
+    # if they are not already in the cache)
     z = ds.z_rho.values
     zw = ds.z_w.values
-    eta = ds.zeta.values
-    salt = ds.salt.values
-    temp = ds.temp.values
     lon = ds.lon_rho.values
     lat = ds.lat_rho.values
-    u = ds.u.values
-    v = ds.v.values
     NT, N = z.shape
 
     # make time-mean z positions so we can isolate baroclinic and SSH
@@ -65,24 +85,20 @@ for sn in sn_list:
     # adjust so free surface is at 0
     Z -= ZW[-1]
     ZW -= ZW[-1]
-
-    # Equation of state calculations
     p = gsw.p_from_z(Z, lat)
-    SA = gsw.SA_from_SP(salt, p, lon, lat) # absolute salinity
-    CT = gsw.CT_from_pt(SA, temp) # conservative temperature
-    rho = gsw.rho(SA, CT, p)
-    # This is denser than ROMS rho by 0.037 [kg m-3] at the bottom and 0.0046 [kg m-3]
-    # (annual averages), and it is the full density, not density minus 1000.
-    # There was no visual difference between the pressure time series.
 
     # low pass filtered version
-    etalp = zfun.lowpass(eta, f='godin')[pad:-pad:24]
+    # (cached, see lp_fun.py, so the reading and the equation of state are
+    # only done the first time)
+    sl = slice(pad,-pad,24)
+    etalp = lp_fun.get_lp(cache_dir, fn, 'zeta', sl=sl)
     etalp = etalp - np.mean(etalp) # remove mean SSH
-    rholp = zfun.lowpass(rho, f='godin')[pad:-pad:24, :]
-    saltlp = zfun.lowpass(SA, f='godin')[pad:-pad:24, :]
-    templp = zfun.lowpass(CT, f='godin')[pad:-pad:24, :]
-    ulp = zfun.lowpass(u, f='godin')[pad:-pad:24, :]
-    vlp = zfun.lowpass(v, f='godin')[pad:-pad:24, :]
+    eoslp = lp_fun.get_lp(cache_dir, fn, 'eos_gsw', v=get_eos, sl=sl)
+    saltlp = eoslp[:,:,0]
+    templp = eoslp[:,:,1]
+    rholp = eoslp[:,:,2]
+    ulp = lp_fun.get_lp(cache_dir, fn, 'u', sl=sl)
+    vlp = lp_fun.get_lp(cache_dir, fn, 'v', sl=sl)
 
     # also make associated time vectors
     tlp = dt[pad:-pad:24]
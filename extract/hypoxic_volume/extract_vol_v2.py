@@ -6,109 +6,158 @@ updated code to make the volume calculations run faster
 To test on mac:
 run extract_vol_v2 -gtx cas6_v0_live -0 2021.07.03 -1 2022.07.06 -test True 
 
-Need to add in testing lines 
+With -test True only the first history file is done, and the results go to
+separate files ending in _test (started over each time), so a test does not
+change the real output or its manifest.
+
 2 history files, all hypoxia Total processing time = 2.71 sec 
 Add Oag, Total processing time = 185.70 sec (b/c have to calc Oag for each layer whole domain)
+Now Oag is calculated on the water cells in big chunks, see hyp_fun.get_corrosive_dz()
 File size 2 history files = ~103 MB 
 os.stat(file).st_size
 took 806.93 sec on perigee? 
 Testing January 2023 - present
+
+The history files are processed by a multiprocessing Pool of Nproc workers
+using the functions in hyp_fun.py. Each worker reads the grid information
+once instead of once per file, as happened when we launched a new
+get_one_volume.py subprocess for each file. The results go directly into one
+output file (no more temp directory and ncrcat).
+
+The output file LO_output/extract/[gtagex]/hypoxic_volume/extractions/Volumes_O2_Oag.nc
+is kept from run to run along with a manifest (Volumes_O2_Oag_manifest.csv) of
+the dates it has and checksums of their history files. A rerun only does the
+dates that are missing or whose history files have changed, so an interrupted
+extraction can be restarted, and new forecast days can be added to the record
+with a short run.
 """
 
 # imports
-from lo_tools import Lfun, zfun, zrfun
+from lo_tools import Lfun
 from lo_tools import extract_argfun as exfun
-Ldir = exfun.intro() # this handles the argument passing
 
-from subprocess import Popen as Po
-from subprocess import PIPE as Pi
+from multiprocessing import Pool
 
 from time import time
 import sys 
 import pandas as pd
-import xarray as xr
 import numpy as np
-import pickle
-
-fn_list = Lfun.get_fn_list('daily', Ldir, Ldir['ds0'], Ldir['ds1'])
-
-out_dir0 = Ldir['LOo'] / 'extract' / Ldir['gtagex'] / 'hypoxic_volume'
-out_dir = out_dir0 / ('extractions_' + Ldir['ds0'] + '_' + Ldir['ds1'])
-temp_dir = out_dir0 / ('temp_' + Ldir['ds0'] + '_' + Ldir['ds1'])
-Lfun.make_dir(out_dir, clean=True)
-Lfun.make_dir(temp_dir, clean=True)
-
-print('...working on files')
-
-# still working on this if section
-if Ldir['testing']:
-    fn_list = [fn_list[0]]
-
-# loop over all jobs
-tt0 = time()
-N = len(fn_list)
-proc_list = []
-for ii in range(N):
-    # Launch a job and add its process to a list.
-    fn = fn_list[ii]
-    ii_str = ('0000' + str(ii))[-5:]
-    out_fn = temp_dir / ('CC_' + ii_str + '.nc')
-    # use subprocesses
-    cmd_list = ['python3', 'get_one_volume.py',
-            '-lt','daily',
-            '-in_fn',str(fn),
-            '-out_fn', str(out_fn)]
-    proc = Po(cmd_list, stdout=Pi, stderr=Pi)
-    proc_list.append(proc)
-    # If we have accumulated Nproc jobs, or are at the end of the
-    # total number of jobs, then stop and make sure all the jobs
-    # in proc_list have finished, using the communicate method.
-    if ((np.mod(ii,Ldir['Nproc']) == 0) and (ii > 0)) or (ii == N-1):
-        for proc in proc_list:
-            stdout, stderr = proc.communicate()
-            if len(stdout) > 0:
-                print('\nSTDOUT:')
-                print(stdout.decode())
-                sys.stdout.flush()
-            if len(stderr) > 0:
-                print('\nSTDERR:')
-                print(stderr.decode())
-                sys.stdout.flush()
-        # Then initialize a new list.
-        proc_list = []
-    # Print screen output about progress.
-    if (np.mod(ii,10) == 0) and ii>0:
-        print(str(ii), end=', ')
-        sys.stdout.flush()
-    if (np.mod(ii,50) == 0) and (ii > 0):
-        print('') # line feed
-        sys.stdout.flush()
-    if (ii == N-1):
-        print(str(ii))
-        sys.stdout.flush()
-
-print('Total processing time = %0.2f sec' % (time()-tt0))
-
-if Ldir['testing'] == False:
-    
-    # concatenate the records into one file
-    # This bit of code is a nice example of how to replicate a bash pipe
-    pp1 = Po(['ls', str(temp_dir)], stdout=Pi)
-    pp2 = Po(['grep','CC'], stdin=pp1.stdout, stdout=Pi)
-    fn_p = 'Volumes_O2_Oag_'+str(Ldir['ds0'])+'_'+str(Ldir['ds1']+'.nc')
-    temp_fn = str(temp_dir)+'/'+fn_p # this is all the maps put to one
-    cmd_list = ['ncrcat','-p', str(temp_dir), '-O', temp_fn]
-    proc = Po(cmd_list, stdin=pp2.stdout, stdout=Pi, stderr=Pi)
-    stdout, stderr = proc.communicate()
-    if len(stdout) > 0:
-        print('\nSTDOUT:')
-        print(stdout.decode())
-        sys.stdout.flush()
-    if len(stderr) > 0:
-        print('\nSTDERR:')
-        print(stderr.decode())
-        sys.stdout.flush()
-        
-    ds1 = xr.open_dataset(temp_fn)
-    this_fn = out_dir / (fn_p)
-    ds1.to_netcdf(this_fn)
\ No newline at end of file
+import netCDF4 as nc
+import hyp_fun
+
+# Oxygen thresholds [uM] for the thickness maps. Edit this to add others,
+# e.g. th_dict = hyp_fun.th_dict | {'low_dz': 150}
+th_dict = hyp_fun.th_dict
+# Set do_Oag = True to add the corrosive (aragonite undersaturated) layer.
+# Oag_screen = (0, 300) skips the carbon calculation for cells that are far
+# from saturation, see hyp_fun.get_corrosive_dz().
+do_Oag = False
+Oag_screen = None
+# The output file is extended each time this is run, and only history files
+# that are new or have changed are processed. Set clean = True to start over.
+clean = False
+# Optional sub-domain: a lat/lon box aa = [lon0, lon1, lat0, lat1], or the
+# name of a polygon in LO_output/section_lines/poly_[poly_name].p, e.g. 'sog'.
+# Only that part of each history file is read.
+aa = None
+poly_name = None
+
+if __name__ == '__main__':
+    # The main guard is needed because the worker processes may import this
+    # module.
+
+    Ldir = exfun.intro() # this handles the argument passing
+
+    fn_list = Lfun.get_fn_list('daily', Ldir, Ldir['ds0'], Ldir['ds1'])
+
+    out_dir0 = Ldir['LOo'] / 'extract' / Ldir['gtagex'] / 'hypoxic_volume'
+    out_dir = out_dir0 / 'extractions'
+    Lfun.make_dir(out_dir, clean=(clean and not Ldir['testing']))
+    fn_p = 'Volumes_O2_Oag'
+    if poly_name is not None:
+        p = pd.read_pickle(Ldir['LOo'] / 'section_lines' / ('poly_' + poly_name + '.p'))
+        xy = np.concatenate((p.x.to_numpy().reshape(-1,1),p.y.to_numpy().reshape(-1,1)), axis=1)
+        fn_p += '_' + poly_name
+    else:
+        xy = None
+        if aa is not None:
+            fn_p += '_box'
+    if Ldir['testing']:
+        fn_list = [fn_list[0]]
+        fn_p += '_test'
+    out_fn = out_dir / (fn_p + '.nc')
+    man_fn = out_dir / (fn_p + '_manifest.csv')
+    settings = str({'th_dict':th_dict, 'do_Oag':do_Oag, 'Oag_screen':Oag_screen,
+        'aa':aa, 'poly_name':poly_name})
+
+    # The manifest has a row for each date already in the output file,
+    # with the history file, its checksum, and the record it is in.
+    hyp_fun.init_worker(fn_list[0], do_Oag=do_Oag, th_dict=th_dict, aa=aa, xy=xy) # grid information for the output
+    if out_fn.is_file() and man_fn.is_file() and not Ldir['testing']:
+        man = pd.read_csv(man_fn, index_col=0, dtype={'checksum':str})
+        ds = nc.Dataset(out_fn, 'a')
+        if ds.settings != settings:
+            print('Error: the choices do not match those used for')
+            print(str(out_fn))
+            print('so set clean = True to start over.')
+            sys.exit()
+    else:
+        man = pd.DataFrame(columns=['fn', 'checksum', 'record'])
+        ds = hyp_fun.start_output(out_fn)
+        ds.settings = settings
+
+    # Make the list of files that are new or have changed. New dates go into
+    # unused records first (e.g. from an interrupted run), then onto the end.
+    nrec = ds.dimensions['ocean_time'].size
+    free_list = sorted(set(range(nrec)) - set(man['record']))
+    task_list = []
+    task_dict = dict()
+    for fn in fn_list:
+        ds_str = fn.parent.name[1:]
+        checksum = hyp_fun.get_checksum(fn)
+        if ds_str in man.index:
+            if man.loc[ds_str, 'checksum'] == checksum:
+                continue
+            rec = man.loc[ds_str, 'record']
+        elif len(free_list) > 0:
+            rec = free_list.pop(0)
+        else:
+            rec = nrec
+            nrec += 1
+        task_list.append((rec, fn))
+        task_dict[rec] = (ds_str, str(fn), checksum)
+    N = len(task_list)
+    print('...working on %d of %d files' % (N, len(fn_list)))
+
+    # Do the jobs in a pool of worker processes. Each worker loads the grid
+    # information once, when it starts, and then processes history files from
+    # the queue until they are all done. The workers only send back the
+    # thickness maps, which we write straight into their record in the
+    # output file, so there are no temporary files to concatenate. The
+    # manifest is saved after each one, so a failed run can just be restarted.
+    tt0 = time()
+    if N > 0:
+        with Pool(Ldir['Nproc'], initializer=hyp_fun.init_worker, initargs=(fn_list[0], do_Oag, th_dict, Oag_screen, aa, xy)) as pool:
+            for nn, (ii, CC) in enumerate(pool.imap_unordered(hyp_fun.get_one, task_list)):
+                hyp_fun.write_record(ds, ii, CC)
+                ds.sync()
+                ds_str, fn, checksum = task_dict[ii]
+                man.loc[ds_str] = [fn, checksum, ii]
+                man.to_csv(man_fn)
+                # Print screen output about progress.
+                if (np.mod(nn,10) == 0) and nn>0:
+                    print(str(nn), end=', ')
+                    sys.stdout.flush()
+                if (np.mod(nn,50) == 0) and (nn > 0):
+                    print('') # line feed
+                    sys.stdout.flush()
+                if (nn == N-1):
+                    print(str(nn))
+                    sys.stdout.flush()
+    ds.close()
+
+    # put the records in time order if needed
+    man = hyp_fun.compact_output(out_fn, man)
+    man.to_csv(man_fn)
+
+    print('Total processing time = %0.2f sec' % (time()-tt0))
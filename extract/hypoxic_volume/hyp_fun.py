@@ -0,0 +1,359 @@
+"""
+Functions for the hypoxic volume extraction.
+
+The extraction is organized around a pool of worker processes. Each worker
+calls init_worker() once, which loads the grid and S-coordinate information
+that do not change with time, and then calls get_one() for each history file
+it is given, which only reads the fields that do change with time. The
+results are written into one output file as they come back, using
+start_output() and write_record().
+
+get_corrosive_dz() (do_Oag = True) also needs gsw and PyCO2SYS, which are in
+the loenv environment.
+"""
+
+import numpy as np
+import xarray as xr
+import matplotlib.path as mpth
+import sys
+from pathlib import Path
+import netCDF4 as nc
+from lo_tools import zrfun
+
+# Hypoxia thresholds [uM] for the default thickness variables. The
+# thresholds can be anything, and in any order.
+th_dict = {'mild_dz': 106.6, 'hyp_dz': 60.9, 'severe_dz': 21.6, 'anoxic_dz': 0}
+long_name_dict = {'mild_dz': 'Thickness of mild hypoxic layer',
+    'hyp_dz': 'Thickness of hypoxic layer',
+    'severe_dz': 'Thickness of severe hypoxic layer',
+    'anoxic_dz': 'Thickness of anoxic layer',
+    'corrosive_dz': 'Thickness of undersaturated layer'}
+
+# Grid information for this process, filled by init_worker().
+grid = dict()
+
+def get_grid(fn, aa=None, xy=None):
+    """
+    Get the fields that do not change with time from the history file fn.
+
+    To work on part of the domain pass either a lat/lon box
+    aa = [lon0, lon1, lat0, lat1] or a polygon xy packed (npoints, 2) as
+    lon, lat. We keep the index ranges (jj, ii) of the smallest rectangle
+    of rho-points that holds the region, so that only that hyperslab is
+    read from each history file, and mask, which is True for water cells
+    in the region.
+    """
+    ds = xr.open_dataset(fn, decode_times=False)
+    G, S, T = zrfun.get_basic_info(fn)
+    lon = ds.lon_rho.values
+    lat = ds.lat_rho.values
+    if aa is not None:
+        isin = (lon >= aa[0]) & (lon <= aa[1]) & (lat >= aa[2]) & (lat <= aa[3])
+    elif xy is not None:
+        path = mpth.Path(xy)
+        isin = path.contains_points(np.concatenate((lon.reshape(-1,1),
+            lat.reshape(-1,1)), axis=1)).reshape(lon.shape)
+    else:
+        isin = np.ones(lon.shape, dtype=bool)
+    if not isin.any():
+        print('Error: no grid points in the region')
+        sys.exit()
+    jjj, iii = np.nonzero(isin)
+    jj = slice(jjj.min(), jjj.max()+1)
+    ii = slice(iii.min(), iii.max()+1)
+    g = dict()
+    g['S'] = S
+    g['jj'] = jj
+    g['ii'] = ii
+    g['lon'] = lon[jj,ii]
+    g['lat'] = lat[jj,ii]
+    g['DA'] = (1/ds.pm.values[jj,ii]) * (1/ds.pn.values[jj,ii]) # cell horizontal area [m2]
+    g['h'] = ds.h.values[jj,ii]
+    g['mask_rho'] = ds.mask_rho.values[jj,ii]
+    g['mask'] = (g['mask_rho'] == 1) & isin[jj,ii]
+    g['h_attrs'] = {'units':ds.h.units, 'long_name': ds.h.long_name}
+    g['ot_attrs'] = {'long_name':ds.ocean_time.long_name,'units':ds.ocean_time.units}
+    ds.close()
+    return g
+
+def init_worker(fn, do_Oag=False, th_dict=th_dict, Oag_screen=None,
+    aa=None, xy=None):
+    """
+    Initializer for a worker process: load the grid information once.
+    Set do_Oag = True to also calculate the corrosive layer thickness, and
+    see get_corrosive_dz() for Oag_screen.
+    th_dict has the names of the thickness variables and their oxygen
+    thresholds [uM].
+    See get_grid() for the optional region aa or xy.
+    """
+    grid.update(get_grid(fn, aa=aa, xy=xy))
+    grid['do_Oag'] = do_Oag
+    grid['Oag_screen'] = Oag_screen
+    grid['th_dict'] = th_dict
+
+def get_field(ds, vn):
+    """
+    Read the hyperslab of variable vn for the region from the history file
+    ds, with the singleton time dimension removed. We only remove that axis,
+    so a region one row or column wide keeps its (eta_rho, xi_rho) shape.
+    """
+    return ds[vn].isel(ocean_time=0, eta_rho=grid['jj'], xi_rho=grid['ii']).values
+
+def get_thickness(oxy, dzr, th_list, DA=None):
+    """
+    Thickness [m] of the water with oxygen at or below each of the
+    thresholds in th_list [uM], from the 3-D oxygen field oxy and the cell
+    thicknesses dzr, both packed (z,y,x). Cells where oxy is nan do not count.
+
+    This is done in one pass over the oxygen field: each cell is put in a
+    bin between consecutive (sorted) thresholds, we add up dzr in each bin and
+    water column with bincount, and then the cumulative sum over the bins gives
+    the thickness below each threshold.
+
+    Returns thick packed (nthresh,y,x), and if the cell areas DA [m2] are
+    given, also vol [m3] packed (nthresh,), the volume below each threshold.
+    """
+    th = np.array(th_list, dtype=float)
+    nth = len(th)
+    isort = np.argsort(th)
+    NZ, NR, NC = oxy.shape
+    NP = NR*NC
+    # bin k is oxy in (th[k-1], th[k]] for the sorted thresholds, and bin nth
+    # is everything above the top threshold, including nan
+    ib = np.searchsorted(th[isort], oxy.reshape(NZ,NP), side='left')
+    ib = ib * NP + np.arange(NP)
+    dz_bin = np.bincount(ib.ravel(), weights=dzr.ravel(), minlength=(nth+1)*NP)
+    dz_cum = np.cumsum(dz_bin[:nth*NP].reshape(nth,NP), axis=0)
+    thick = np.zeros((nth,NP))
+    thick[isort,:] = dz_cum
+    thick = thick.reshape(nth,NR,NC)
+    if DA is None:
+        return thick
+    else:
+        vol = np.nansum(thick * DA, axis=(1,2))
+        return thick, vol
+
+def get_one(task):
+    """
+    Do the hypoxic volume calculation for one history file. task is a tuple
+    of (file number, history file). Returns the file number and a dict
+    with ocean_time, the thickness maps, and the volumes [m3] for each
+    threshold (e.g. hyp_vol for hyp_dz). This assumes init_worker() has
+    been called in this process.
+    """
+    ii, fn = task
+    ds = xr.open_dataset(fn, decode_times=False)
+    # the decode_times=False part is important for correct treatment
+    # of the time axis later when we concatenate things
+    CC = dict()
+    CC['ocean_time'] = ds.ocean_time.values
+    zeta = get_field(ds, 'zeta')
+    oxy = get_field(ds, 'oxygen')
+    if grid['do_Oag']:
+        z_rho, z_w = zrfun.get_z(grid['h'], zeta, grid['S'])
+    else:
+        z_w = zrfun.get_z(grid['h'], zeta, grid['S'], only_w=True)
+    dzr = np.diff(z_w, axis=0)
+    vn_list = list(grid['th_dict'].keys())
+    DA = np.where(grid['mask'], grid['DA'], 0) # only count the region
+    thick, vol = get_thickness(oxy, dzr, [grid['th_dict'][vn] for vn in vn_list],
+        DA=DA)
+    for ii_th, vn in enumerate(vn_list):
+        CC[vn] = thick[ii_th,:,:]
+        CC[vn.replace('_dz','_vol')] = vol[ii_th]
+    if grid['do_Oag']:
+        CC['corrosive_dz'] = get_corrosive_dz(ds, zeta, z_rho, dzr,
+            screen=grid['Oag_screen'])
+        CC['corrosive_vol'] = np.nansum(CC['corrosive_dz'] * DA)
+    ds.close()
+    for vn in CC.keys():
+        if vn.endswith('_dz'):
+            # zero thickness in the water, nan on land and outside the region
+            CC[vn] = np.where(grid['mask'], CC[vn], np.nan)
+    return ii, CC
+
+def get_corrosive_dz(ds, zeta, z_rho, dzr, screen=None, chunk=100000):
+    """
+    Map of the thickness [m] of water undersaturated in aragonite, see
+    test_one_file.py for the details of the carbon calculation.
+
+    Instead of calling pyco2 on each layer we flatten the 3-D fields to the
+    water cells only (the grid is about half land), do the gsw conversions
+    once, and then call pyco2.sys() on chunks of chunk cells, which keeps it
+    from getting bogged down.
+
+    screen = (lo, hi) [umol kg-1] is an optional shortcut: cells with
+    ALK-TIC < lo are counted as corrosive and cells with ALK-TIC > hi are
+    counted as not corrosive, without calling pyco2. ALK-TIC is roughly the
+    carbonate ion concentration, and aragonite saturation happens at about
+    60-150 umol kg-1, so something like (0, 300) is safe, but check it against
+    screen=None for a new domain.
+    """
+    import gsw
+    import PyCO2SYS as pyco2
+    mask = np.broadcast_to(grid['mask'], dzr.shape)
+    SP = get_field(ds, 'salt')[mask] # practical salinity
+    PT = get_field(ds, 'temp')[mask] # potential temperature [degC]
+    ALK = get_field(ds, 'alkalinity')[mask] # alkalinity [micro equivalents L-1]
+    TIC = get_field(ds, 'TIC')[mask] # TIC [micromol C L-1]
+    # only use cells where everything is good
+    good = np.isfinite(SP) & np.isfinite(PT) & np.isfinite(ALK) & np.isfinite(TIC)
+    mask = mask.copy()
+    mask[mask] = good
+    SP = SP[good]
+    SP[SP<0] = 0 # could be a problem for pyco2
+    PT = PT[good]
+    ALK = ALK[good]
+    TIC = TIC[good]
+    lon = np.broadcast_to(grid['lon'], dzr.shape)[mask]
+    lat = np.broadcast_to(grid['lat'], dzr.shape)[mask]
+    # gsw.p_from_z uses p_ref = 0 and requires z's to be negative, so we
+    # adjust zeta to zero for the pressure calculation
+    p = gsw.p_from_z((z_rho - zeta)[mask], lat) # pressure [dbar]
+    SA = gsw.SA_from_SP(SP, p, lon, lat) # absolute salinity [g kg-1]
+    CT = gsw.CT_from_pt(SA, PT) # conservative temperature [degC]
+    rho = gsw.rho(SA, CT, p) # in situ density [kg m-3]
+    ti = gsw.t_from_CT(SA, CT, p) # in situ temperature [degC]
+    # convert from micromol/L to micromol/kg using in situ density
+    ALK = 1000 * ALK / rho
+    TIC = 1000 * TIC / rho
+    # small values of these used to cause big slowdowns in CO2SYS
+    ALK[ALK < 100] = 100
+    TIC[TIC < 100] = 100
+
+    # aragonite saturation state for the water cells
+    arag = np.nan * np.ones(ALK.shape)
+    if screen is None:
+        isolve = np.arange(len(ALK))
+    else:
+        lo, hi = screen
+        excess = ALK - TIC
+        arag[excess < lo] = 0
+        arag[excess > hi] = 2
+        isolve = np.flatnonzero((excess >= lo) & (excess <= hi))
+    for i0 in range(0, len(isolve), chunk):
+        ii = isolve[i0:i0+chunk]
+        CO2dict = pyco2.sys(par1=ALK[ii], par1_type=1, par2=TIC[ii], par2_type=2,
+            salinity=SP[ii], temperature=ti[ii], pressure=p[ii],
+            total_silicate=50, total_phosphate=2, opt_k_carbonic=10, opt_buffers_mode=0)
+        arag[ii] = CO2dict['saturation_aragonite']
+
+    corrosive = np.zeros(dzr.shape, dtype=bool)
+    corrosive[mask] = arag <= 1
+    corrosive_dz = np.where(corrosive, dzr, 0).sum(axis=0)
+    return corrosive_dz
+
+def get_long_name(vn):
+    """
+    The long_name attribute for the thickness variable vn.
+    """
+    if vn in long_name_dict.keys():
+        return long_name_dict[vn]
+    else:
+        return 'Thickness of water with oxygen <= %g uM' % (grid['th_dict'][vn])
+
+def get_vn_list():
+    """
+    Names of the thickness variables this process calculates. Each also has
+    a volume, e.g. hyp_vol for hyp_dz.
+    """
+    vn_list = list(grid['th_dict'].keys())
+    if grid['do_Oag']:
+        vn_list.append('corrosive_dz')
+    return vn_list
+
+def start_output(out_fn):
+    """
+    Create a NetCDF file for the results, using the grid information from
+    init_worker(). ocean_time is unlimited, and the results for each history
+    file are written into it by write_record(), in any order.
+    """
+    NR, NC = grid['h'].shape
+    ds = nc.Dataset(out_fn, 'w')
+    ds.createDimension('ocean_time', None)
+    ds.createDimension('eta_rho', NR)
+    ds.createDimension('xi_rho', NC)
+    vv = ds.createVariable('ocean_time', float, ('ocean_time',))
+    vv.setncatts(grid['ot_attrs'])
+    for vn in get_vn_list():
+        vv = ds.createVariable(vn, float, ('ocean_time', 'eta_rho', 'xi_rho'),
+            chunksizes=(1, NR, NC), fill_value=np.nan)
+        vv.units = 'm'
+        vv.long_name = get_long_name(vn)
+        vv = ds.createVariable(vn.replace('_dz','_vol'), float, ('ocean_time',),
+            fill_value=np.nan)
+        vv.units = 'm^3'
+        vv.long_name = get_long_name(vn).replace('Thickness', 'Volume')
+    for vn, val, attrs in [('DA', grid['DA'], {'units':'m^2', 'long_name': 'cell horizontal area '}),
+        ('mask_rho', grid['mask_rho'], {'flag_values':[0., 1.],'flag_meanings':'land water','long_name': 'mask on RHO-points'}),
+        ('h', grid['h'], grid['h_attrs']),
+        ('Lat', grid['lat'], {'units':'degree_north','long_name': 'latitude of RHO-points'}),
+        ('Lon', grid['lon'], {'units':'degree_east','long_name': 'longitude of RHO-points'})]:
+        vv = ds.createVariable(vn, float, ('eta_rho', 'xi_rho'))
+        vv.setncatts(attrs)
+        vv[:] = val
+    # index ranges of the region in the full grid
+    ds.eta_rho_range = [grid['jj'].start, grid['jj'].stop]
+    ds.xi_rho_range = [grid['ii'].start, grid['ii'].stop]
+    return ds
+
+def write_record(ds, ii, CC):
+    """
+    Write the results CC from get_one() for file number ii into the open
+    output Dataset ds from start_output().
+    """
+    ds['ocean_time'][ii] = CC['ocean_time']
+    for vn in get_vn_list():
+        ds[vn][ii,:,:] = CC[vn]
+        ds[vn.replace('_dz','_vol')][ii] = CC[vn.replace('_dz','_vol')]
+
+def write_one(out_fn, CC):
+    """
+    Write the results for one history file to out_fn.
+    """
+    ds = start_output(out_fn)
+    write_record(ds, 0, CC)
+    ds.close()
+
+def get_checksum(fn, nbytes=2**20):
+    """
+    A quick checksum of the history file fn, to tell if it has changed since
+    it was processed. Reading all of a history file just for this would take
+    about as long as processing it, so we use the size and md5 of the first
+    and last nbytes.
+    """
+    import hashlib
+    size = Path(fn).stat().st_size
+    md5 = hashlib.md5(str(size).encode())
+    with open(fn, 'rb') as f:
+        md5.update(f.read(nbytes))
+        f.seek(max(size - nbytes, 0))
+        md5.update(f.read(nbytes))
+    return md5.hexdigest()
+
+def compact_output(out_fn, man):
+    """
+    Make the records of the output file out_fn be the dates in the manifest
+    man in time order, with no unused records. This only rewrites the file
+    if that is not already true, e.g. if earlier dates were added in a later
+    run, or a run was interrupted. Returns the updated manifest.
+    """
+    man = man.sort_index()
+    ds = nc.Dataset(out_fn)
+    nrec = ds.dimensions['ocean_time'].size
+    ds.close()
+    if len(man) == nrec and (man['record'].to_numpy() == np.arange(nrec)).all():
+        return man
+    temp_fn = out_fn.parent / ('temp_' + out_fn.name)
+    ds0 = nc.Dataset(out_fn)
+    ds1 = start_output(temp_fn)
+    ds1.settings = ds0.settings
+    vn_list = [vn for vn in ds0.variables if ds0[vn].dimensions[0] == 'ocean_time']
+    for new_rec, old_rec in enumerate(man['record'].to_numpy()):
+        for vn in vn_list:
+            ds1[vn][new_rec] = ds0[vn][old_rec]
+    ds0.close()
+    ds1.close()
+    temp_fn.replace(out_fn)
+    man['record'] = np.arange(len(man))
+    return man
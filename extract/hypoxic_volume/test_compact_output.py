@@ -0,0 +1,69 @@
+"""
+Code to test hyp_fun.compact_output() for the case where a run was interrupted
+(leaving unused records in the output file) and the next run covers fewer
+dates, so the manifest has fewer rows than the file has records.
+
+It makes a small fake grid by hand, so it does not need any history files,
+and works in a temporary directory.
+
+run test_compact_output
+"""
+
+import numpy as np
+import pandas as pd
+import netCDF4 as nc
+import tempfile
+import sys
+from pathlib import Path
+import hyp_fun
+
+# fake grid information, as from hyp_fun.init_worker()
+NR, NC = 3, 4
+hyp_fun.grid.update({'h':10*np.ones((NR,NC)), 'DA':np.ones((NR,NC)),
+    'mask_rho':np.ones((NR,NC)), 'lon':np.zeros((NR,NC)), 'lat':np.zeros((NR,NC)),
+    'h_attrs':{'units':'m', 'long_name':'bathymetry at RHO-points'},
+    'ot_attrs':{'long_name':'time since initialization', 'units':'seconds since 1970-01-01 00:00:00'},
+    'jj':slice(0,NR), 'ii':slice(0,NC), 'th_dict':hyp_fun.th_dict, 'do_Oag':False})
+vn_list = hyp_fun.get_vn_list()
+
+def get_CC(day):
+    # fake results for one history file, with values that tell us the day
+    CC = {'ocean_time':day*86400.}
+    for vn in vn_list:
+        CC[vn] = day*np.ones((NR,NC))
+        CC[vn.replace('_dz','_vol')] = day*NR*NC
+    return CC
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    out_fn = Path(temp_dir) / 'Volumes_O2_Oag.nc'
+
+    # First run: four dates were given records 0-3, but the run was
+    # interrupted after only days 3 and 1 were written, into records 2 and 0.
+    ds = hyp_fun.start_output(out_fn)
+    ds.settings = 'test'
+    man = pd.DataFrame(columns=['fn', 'checksum', 'record'])
+    for rec, day in [(2, 3), (0, 1)]:
+        hyp_fun.write_record(ds, rec, get_CC(day))
+        man.loc['2021.07.0' + str(day)] = ['fn', 'checksum', rec]
+    ds['ocean_time'][3] = np.nan # the last record exists but was never written
+    ds.close()
+
+    # Second run: only days 1 and 3 are asked for, they are already done, so
+    # there is nothing new to write and we go straight to compact_output().
+    man = hyp_fun.compact_output(out_fn, man)
+
+    ds = nc.Dataset(out_fn)
+    nrec = ds.dimensions['ocean_time'].size
+    ot = ds['ocean_time'][:]
+    hyp = ds['hyp_dz'][:]
+    ds.close()
+    if nrec != 2:
+        print('Error: expected 2 records, found %d' % (nrec))
+        sys.exit()
+    if not (ot == np.array([1, 3])*86400.).all() or not (hyp[:,0,0] == np.array([1, 3])).all():
+        print('Error: records are not the right days in time order')
+        sys.exit()
+    if not (man['record'].to_numpy() == np.arange(2)).all():
+        print('Error: manifest records not updated')
+        sys.exit()
+    print('compact_output() OK: %d records, days = %s' % (nrec, str(ot/86400)))
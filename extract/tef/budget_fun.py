@@ -0,0 +1,247 @@
+"""
+Functions for making tracer budgets for volumes made of TEF segments.
+
+A volume is defined by its list of segments and a dict of the open sections
+around it, with the sign for each section indicating which direction is INTO
+the volume, like:
+
+vol_dict['Hood Canal'] = {'seg_list':flux_fun.ssH, 'sect_sign_dict':{'hc1':-1}}
+
+load_data() reads the river extraction, the segment time series, and the
+two-layer TEF at all the sections needed for all the volumes, once. Then
+get_budgets() does the budgets for all the volumes and any list of tracers,
+by summing the segment, river, and section time series into volumes with
+sum_vols(), for all the tracers and volumes together, so the lowpass is only
+done once.
+
+An important step is that we "adjust" the storage term to absorb the dV/dt
+term, which makes the results clearer.
+
+Use it from another directory like this:
+
+pth = Ldir['parent'] / 'LPM' / 'extract' / 'tef'
+if str(pth) not in sys.path:
+    sys.path.append(str(pth))
+import budget_fun
+"""
+
+import sys
+import numpy as np
+import pandas as pd
+import xarray as xr
+from lo_tools import zfun
+
+def get_flux_fun(Ldir):
+    """
+    Import flux_fun (and tef_fun) from LO.
+    """
+    pth = str(Ldir['LO'] / 'extract' /'tef')
+    if pth not in sys.path:
+        sys.path.append(pth)
+    import flux_fun
+    return flux_fun
+
+def get_vol_dict(Ldir):
+    """
+    The segments and signed sections for all the volumes we use.
+    """
+    ff = get_flux_fun(Ldir)
+    vol_dict = dict()
+    vol_dict['Salish Sea'] = {'seg_list':(ff.ssA + ff.ssM + ff.ssT + ff.ssS + ff.ssW + ff.ssH
+        + ff.ssJ + ff.ssG), 'sect_sign_dict':{'jdf1':1, 'sog5':-1}}
+    vol_dict['Strait of Georgia'] = {'seg_list':ff.ssG, 'sect_sign_dict':{'sji1':1, 'sog5':-1}}
+    vol_dict['Puget Sound'] = {'seg_list':(ff.ssA + ff.ssM + ff.ssT + ff.ssS + ff.ssW + ff.ssH),
+        'sect_sign_dict':{'ai1':1, 'dp':1}}
+    vol_dict['Puget Sound no AI'] = {'seg_list':(ff.ssM + ff.ssT + ff.ssS + ff.ssW),
+        'sect_sign_dict':{'ai4':1, 'dp':1}}
+    vol_dict['Hood Canal'] = {'seg_list':ff.ssH, 'sect_sign_dict':{'hc1':-1}}
+    vol_dict['South Sound'] = {'seg_list':ff.ssT + ff.ssS, 'sect_sign_dict':{'tn1':-1}}
+    return vol_dict
+
+def get_sum_matrix(item_list_list):
+    """
+    Given a list (one per volume) of lists of names, return the names
+    used by any volume, and the matrix M packed (Nname, Nvol) of how many
+    times each name is in each volume, used by sum_vols(). We count
+    repeats the way they were counted in the old per-volume code.
+    """
+    name_list = []
+    for item_list in item_list_list:
+        name_list += [item for item in item_list if item not in name_list]
+    M = np.zeros((len(name_list), len(item_list_list)))
+    for jj, item_list in enumerate(item_list_list):
+        for item in item_list:
+            M[name_list.index(item), jj] += 1
+    return name_list, M
+
+def sum_vols(x, M):
+    """
+    Sum x packed (NT, Nname) over the members of each volume, using M from
+    get_sum_matrix(), giving an array packed (NT, Nvol). We only use the
+    members of each volume (not x @ M) because nan * 0 = nan, so a nan in
+    one segment, river, or section would make every volume nan.
+    """
+    out = np.zeros((x.shape[0], M.shape[1]))
+    for jj in range(M.shape[1]):
+        mm = M[:,jj] > 0
+        out[:,jj] = x[:,mm] @ M[mm,jj]
+    return out
+
+def load_data(Ldir, year, vol_dict):
+    """
+    Load everything needed for the budgets of all the volumes in vol_dict,
+    for the given year [For cas6_v3_lo8b I have 2017-2020].
+
+    Returns a dict with riv_ds (daily, noon of each day) and seg_ds (hourly)
+    reduced to the rivers and segments we use, the dict tef_df_dict of
+    two-layer TEF DataFrames (daily) for each section, and the matrices that
+    sum segments (Mseg), rivers (Mriv), and sections (Msect) into volumes.
+    """
+    ff = get_flux_fun(Ldir)
+    year_str = str(year)
+    date_str = '_' + year_str + '.01.01_' + year_str + '.12.31'
+    riv_fn = Ldir['LOo'] / 'pre' / 'river' / Ldir['gtag'] / 'Data_roms' / ('extraction' + date_str + '.nc')
+    tef_dir = Ldir['LOo'] / 'extract' / Ldir['gtagex'] / 'tef' / ('bulk' + date_str)
+    seg_fn = Ldir['LOo'] / 'extract' / Ldir['gtagex'] / 'tef' / ('segments' + date_str + '.nc')
+
+    vol_list = list(vol_dict.keys())
+    D = dict()
+    D['vol_list'] = vol_list
+
+    # SEGMENT TIME SERIES
+    """
+    These are stored in an xr.Dataset:
+    time = hourly (so we lowpass, subsample, and clip the ends)
+    seg = segment names
+    variable names = volume + all the tracers in tef_fun.vn_list
+    - note that the tracers are the average in each volume
+    """
+    seg_list, D['Mseg'] = get_sum_matrix([vol_dict[vol]['seg_list'] for vol in vol_list])
+    D['seg_ds'] = xr.open_dataset(seg_fn).sel(seg=seg_list)
+
+    # RIVERS
+    """
+    These are stored in an xr.Dataset:
+    time = daily, noon of each day
+    riv = river names
+    variable names: transport + all the tracers in tef_fun.vn_list
+    """
+    riv_list_list = []
+    for vol in vol_list:
+        river_list = []
+        for seg_name in vol_dict[vol]['seg_list']:
+            river_list = river_list + ff.segs[seg_name]['R']
+        riv_list_list.append(river_list)
+    river_list, D['Mriv'] = get_sum_matrix(riv_list_list)
+    D['riv_ds'] = xr.open_dataset(riv_fn).sel(riv=river_list)
+
+    # TEF at SECTIONS
+    sect_list, D['Msect'] = get_sum_matrix([list(vol_dict[vol]['sect_sign_dict'].keys())
+        for vol in vol_list])
+    D['sect_list'] = sect_list
+    tef_df_dict = dict()
+    for sn in sect_list:
+        tef_df_dict[sn], in_sign, _, _ = ff.get_two_layer(tef_dir, sn, Ldir['gridname'])
+        for vol in vol_list:
+            if in_sign != vol_dict[vol]['sect_sign_dict'].get(sn, in_sign):
+                print('WARNING: potential sign error!! (%s, %s)' % (vol, sn))
+    D['tef_df_dict'] = tef_df_dict
+    return D
+
+def get_budgets(D, vn_list, pad=36):
+    """
+    Budgets of volume and of the tracers in vn_list (e.g. salt, NO3, oxygen)
+    for all the volumes in D (from load_data()).
+
+    Returns a dict keyed by volume name, each a dict with 'vol' = the volume
+    budget DataFrame (Qin, Qout, Qr, dV_dt, Error [m3 s-1]) plus the mean
+    volume V [m3] and vol_rel_err, and one tracer budget DataFrame per tracer
+    vn in vn_list. The tracer budget terms are in [C 10^3 m3 s-1] where C is
+    the tracer unit:
+    Storage = adjusted storage rate, d(sum(C*v))/dt - dV/dt * Cout
+    QinDC = exchange flow term, Qin * (Cin - Cout)
+    -QrCout = river dilution term
+    QrCr = river tracer input (zero if the river extraction has no vn)
+    Error = Storage - QinDC - (-QrCout) - QrCr, which is the source/sink
+        for non-conservative tracers
+    and also Qprism, Qr, Qin, QCin, QCout [10^3 m3 s-1] and DC [C].
+    """
+    vol_list = D['vol_list']
+    Nvol = len(vol_list)
+    seg_ds = D['seg_ds']
+    riv_ds = D['riv_ds']
+    tef_df_dict = D['tef_df_dict']
+    sect_list = D['sect_list']
+
+    # Rates of change of volume and of volume-integrated tracers, summed
+    # into volumes, for all volumes and tracers at once, so we only call
+    # the lowpass once.
+    sv = seg_ds.volume.values
+    seg_NT = sv.shape[0]
+    x_list = [sv] + [sv * seg_ds[vn].values for vn in vn_list]
+    xt = np.nan * np.ones((seg_NT, len(x_list) * Nvol))
+    for ii, x in enumerate(x_list):
+        xt[1:-1, ii*Nvol:(ii+1)*Nvol] = sum_vols(x[2:] - x[:-2], D['Mseg'])/(2*3600)
+    xt_lp = zfun.lowpass(xt, f='godin')[pad:-pad+1:24]
+    vt_lp = xt_lp[:, :Nvol]
+    # volume
+    v = zfun.lowpass(sv, f='godin')[pad:-pad+1:24]
+    vnet = sum_vols(v, D['Mseg'])
+
+    # time index to use
+    indall = tef_df_dict[sect_list[0]].index
+    def get_sect(vn):
+        # section values packed (NT, Nsect), aligned on indall
+        return np.stack([tef_df_dict[sn][vn].reindex(indall).values for sn in sect_list], axis=1)
+    Msect = D['Msect']
+    Qin_s = get_sect('Qin')
+    Qout_s = get_sect('Qout')
+    Qin = sum_vols(Qin_s, Msect)
+    Qout = sum_vols(Qout_s, Msect)
+    Qprism = sum_vols(get_sect('qabs')/2, Msect)
+    riv_Q = riv_ds.transport.values
+    Qr = sum_vols(riv_Q, D['Mriv'])[1:-1]
+
+    B = dict()
+    for jj, vol in enumerate(vol_list):
+        # Volume budget
+        vol_df = pd.DataFrame(index=indall)
+        vol_df['Qin'] = Qin[:, jj]
+        vol_df['Qout'] = Qout[:, jj]
+        vol_df['Qr'] = Qr[:, jj]
+        vol_df['dV_dt'] = vt_lp[:, jj]
+        vol_df['Error'] = vol_df['dV_dt'] - vol_df['Qin'] - vol_df['Qout'] - vol_df['Qr']
+        B[vol] = {'vol':vol_df, 'V':vnet[:, jj].mean(),
+            'vol_rel_err':vol_df['Error'].mean()/vol_df['Qr'].mean()}
+
+    for ii, vn in enumerate(vn_list):
+        cvt_lp = xt_lp[:, (ii+1)*Nvol:(ii+2)*Nvol]
+        QCin = sum_vols(Qin_s * get_sect(vn + '_in'), Msect)
+        QCout = sum_vols(Qout_s * get_sect(vn + '_out'), Msect)
+        if vn in riv_ds.data_vars:
+            QrCr = sum_vols(riv_Q * riv_ds[vn].values, D['Mriv'])[1:-1]
+        else:
+            QrCr = 0 * Qr
+        # derived
+        Cin = QCin / Qin
+        Cout = QCout / Qout
+        DC = Cin - Cout
+        for jj, vol in enumerate(vol_list):
+            # Fill the budget DataFrame
+            c_df = pd.DataFrame(index=indall)
+            c_df['QinDC'] = Qin[:, jj] * DC[:, jj] / 1000
+            c_df['-QrCout'] = - Qr[:, jj] * Cout[:, jj] / 1000
+            c_df['QrCr'] = QrCr[:, jj] / 1000
+            # We include the time-varying volume term in the storage term
+            c_df['Storage'] = (cvt_lp[:, jj] - vt_lp[:, jj] * Cout[:, jj]) / 1000
+            # The residual of the budget is the error (Sink is negative)
+            c_df['Error'] = c_df['Storage'] - c_df['QinDC'] - c_df['-QrCout'] - c_df['QrCr']
+            # add other things for plotting
+            c_df['Qprism'] = Qprism[:, jj] / 1000
+            c_df['Qr'] = Qr[:, jj] / 1000
+            c_df['Qin'] = Qin[:, jj] / 1000
+            c_df['DC'] = DC[:, jj]
+            c_df['QCin'] = QCin[:, jj] / 1000
+            c_df['QCout'] = QCout[:, jj] / 1000
+            B[vol][vn] = c_df
+    return B
@@ -12,11 +12,8 @@ Ldir = exfun.intro() # this handles the argument passing
 
 import sys
 from time import time
-import numpy as np
 import pickle
 import pandas as pd
-from subprocess import Popen as Po
-from subprocess import PIPE as Pi
 import xarray as xr
 
 pth = Ldir['LO'] / 'extract' / 'tef'
@@ -24,6 +21,11 @@ if str(pth) not in sys.path:
     sys.path.append(str(pth))
 import tef_fun
 
+pth = Ldir['parent'] / 'LPM' / 'misc'
+if str(pth) not in sys.path:
+    sys.path.append(str(pth))
+import job_fun
+
 ds0 = Ldir['ds0']
 ds1 = Ldir['ds1']
 
@@ -47,10 +49,11 @@ Lfun.make_dir(temp_dir, clean=True)
 fn_list = Lfun.get_fn_list('daily', Ldir, ds0, ds1)
     
 print('Doing initial data extraction:')
-# We do extractions one file at a time, as separate subprocess jobs.
+# We do extractions one file at a time, as separate subprocess jobs, using
+# job_fun.run_jobs().
 # Files are saved to temp_dir.
 tt000 = time()
-proc_list = []
+cmd_list_list = []
 N = len(fn_list)
 for ii in range(N):
     fn = fn_list[ii]
@@ -62,17 +65,9 @@ for ii in range(N):
             '-gtagex', Ldir['gtagex'],
             '-d', d, '-nhis', str(nhis),
             '-test', str(Ldir['testing'])]
-    proc = Po(cmd_list, stdout=Pi, stderr=Pi)
-    proc_list.append(proc)
-    
-    Nproc = Ldir['Nproc']
-    if ((np.mod(ii,Nproc) == 0) and (ii > 0)) or (ii == N-1):
-        tt0 = time()
-        for proc in proc_list:
-            proc.communicate()
-        print(' - %d out of %d: %d took %0.2f sec' % (ii, N, Nproc, time()-tt0))
-        sys.stdout.flush()
-        proc_list = []
+    cmd_list_list.append(cmd_list)
+# Nproc jobs are kept running at once
+job_list = job_fun.run_jobs(cmd_list_list, Ldir['Nproc'])
 print('Total elapsed time = %0.2f sec' % (time()-tt000))
 
 """
@@ -0,0 +1,182 @@
+"""
+Functions for working with tef2 section extractions.
+"""
+
+import sys
+import numpy as np
+import pandas as pd
+import xarray as xr
+from pathlib import Path
+from multiprocessing import Pool
+from scipy import sparse
+from lo_tools import Lfun, zrfun, zfun
+
+pth = Path(__file__).absolute().parent.parent.parent / 'misc'
+if str(pth) not in sys.path:
+    sys.path.append(str(pth))
+import lp_fun
+
+def get_transport(ds, A=None, pad=36, Cd=3e-3, nt_chunk=24*31):
+    """
+    Time series of the transport through a section, from the section
+    extraction Dataset ds.
+
+    We sum dd*DZ*vel over the section one chunk of nt_chunk hours at a time,
+    which only reads that much of DZ and vel into memory, instead of forming
+    the full (NT,N,P) product.
+
+    Returns a dict with the hourly net transport qnet [m3 s-1] and its
+    absolute value qabs, and the daily (godin low-passed and subsampled
+    with [pad:-pad+1:24]) Qprism = <|qnet|>/2 [m3 s-1].
+
+    If the section area A [m2] (at ssh = 0) is given it also has the daily
+    ustar2 = 2 * <Cd * u^2> [m2 s-2] where u = qnet/A. The factor of 2 implies
+    that we are using the amplitude of the tidal velocity.
+    To see this, assume u = Ut * cos(om*t), then
+    <u^2> = 1/2 Ut^2, and so Ut^2 = 2 * <u^2>.
+    """
+    dd = ds['dd'].values
+    NT = ds['vel'].shape[0]
+    qnet = np.nan * np.ones(NT)
+    for it0 in range(0, NT, nt_chunk):
+        it1 = min(it0 + nt_chunk, NT)
+        DZ = ds['DZ'][it0:it1,:,:].values
+        vel = ds['vel'][it0:it1,:,:].values
+        qnet[it0:it1] = np.einsum('tnp,tnp,p->t', DZ, vel, dd)
+    T = dict()
+    T['qnet'] = qnet
+    T['qabs'] = np.abs(qnet)
+    T['Qprism'] = zfun.lowpass(T['qabs'], f='godin')[pad:-pad+1:24]/2
+    if A is not None:
+        u = qnet/A
+        T['ustar2'] = 2 * zfun.lowpass(Cd * u * u, f='godin')[pad:-pad+1:24]
+    return T
+
+def get_sz(zf, v, NZ=100, z_range=(-500,0), weights=None):
+    """
+    Time series of profiles v(z) on NZ bins over z_range, from the section
+    field v packed (NT,N,P) and the z-positions of its cells zf, packed (N,P)
+    or flattened. This gives the same result as a loop over time calling
+
+    binned_statistic(zf.flatten(), v[tt,:,:].flatten(), statistic='mean',
+        bins=NZ, range=z_range)
+
+    but because the bin of each cell does not change with time we make the
+    (N*P, NZ) sparse matrix M that averages cells into bins once, and then
+    do a single matrix multiply for all times. Bins with no cells, or with
+    a nan value, are nan.
+
+    If weights (e.g. dd*dz, packed (N,P)) are given it is a weighted mean.
+
+    Returns vz packed (NT,NZ) and the bin_edges.
+    """
+    zf = zf.flatten()
+    NT = v.shape[0]
+    bin_edges = np.linspace(z_range[0], z_range[1], NZ+1)
+    ib = np.searchsorted(bin_edges, zf, side='right') - 1
+    ib[zf == bin_edges[-1]] = NZ-1 # the last bin includes its right edge
+    inbin = (ib >= 0) & (ib < NZ)
+    if weights is None:
+        w = np.ones(len(zf))
+    else:
+        w = weights.flatten()
+    ip = np.flatnonzero(inbin)
+    M = sparse.csr_matrix((w[ip], (ip, ib[ip])), shape=(len(zf), NZ))
+    wsum = np.asarray(M.sum(axis=0)).flatten()
+    wsum[wsum == 0] = np.nan
+    # sparse @ dense with the dense array first: (M.T @ v.T).T
+    vz = np.asarray((M.T @ v.reshape(NT,-1).T).T) / wsum
+    return vz, bin_edges
+
+def get_section(task):
+    """
+    Do all the work for one section, with no side effects, so that it can be
+    run in a pool of processes. task is a tuple of:
+    sn = section name
+    in_fn = section extraction file
+    sdf = the rows of sect_df for this section
+    S = S-coordinate dict
+    G = dict of lou, lau, lov, lav (u- and v-point lon and lat vectors)
+    cache_dir = where to cache the low-passed salt (see lp_fun.py)
+    weighted = True to weight s(z) by cell area (see get_sz())
+
+    Returns sn and a dict with the daily s(z) stz packed (NT,NZ) and its
+    bin_edges, Qprism, ustar2, the mean depth H, the section point lon_vec
+    and lat_vec and their means lon and lat, and the daily times otdt.
+    """
+    sn, in_fn, sdf, S, G, cache_dir, weighted = task
+    out = dict()
+
+    # load fields
+    ds = xr.open_dataset(in_fn)
+    pad = 36
+    salt = lp_fun.get_lp(cache_dir, in_fn, 'salt', sl=slice(pad,-pad+1,24))
+    NT, N, P = salt.shape
+
+    h = ds.h.values
+    zr, zw = zrfun.get_z(h, 0*h, S) # packed (z,p)
+    zf = zr.flatten() # Note: this does not change with time
+    # what if there is only one p?
+    out['H'] = h.mean()
+
+    # get section area (ssh=0)
+    dz = np.diff(zw,axis=0)
+    A = np.sum(ds['dd'].values * dz)
+
+    # make Qprism and the time series of ustar^2
+    T = get_transport(ds, A=A, pad=pad)
+    out['Qprism'] = T['Qprism']
+    out['ustar2'] = T['ustar2']
+
+    # Find mean lat and lon (more work than it should be!).
+    lon_vec = np.concatenate((G['lou'][sdf.loc[(sdf.uv=='u'),'i']],G['lov'][sdf.loc[(sdf.uv=='v'),'i']]))
+    lat_vec = np.concatenate((G['lau'][sdf.loc[(sdf.uv=='u'),'j']],G['lav'][sdf.loc[(sdf.uv=='v'),'j']]))
+    out['lon_vec'] = lon_vec
+    out['lat_vec'] = lat_vec
+    out['lon'] = np.mean(lon_vec)
+    out['lat'] = np.mean(lat_vec)
+
+    # Then we want to form a time series of s(z)
+    if weighted:
+        w = ds['dd'].values * dz
+    else:
+        w = None
+    out['stz'], out['bin_edges'] = get_sz(zf, salt, weights=w)
+
+    ot = ds['time'].to_numpy()
+    ds.close()
+    # do a little massaging of ot
+    dti = pd.to_datetime(ot) # a pandas DatetimeIndex with dtype='datetime64[ns]'
+    dt = dti.to_pydatetime() # an array of datetimes
+    ot = np.array([Lfun.datetime_to_modtime(item) for item in dt])
+    ot = ot[pad:-pad+1:24]
+    # also make an array of datetimes to save as the ot variable
+    out['otdt'] = np.array([Lfun.modtime_to_datetime(item) for item in ot])
+    return sn, out
+
+def get_sections(sect_list, in_dir, sect_df, S, G, cache_dir, Nproc=1, weighted=False):
+    """
+    Run get_section() for all the sections in sect_list, on a pool of Nproc
+    processes if Nproc > 1, and merge the results into a dict of dicts
+    keyed by section name: stz_dict, Qprism_dict, ustar2_dict, H_dict,
+    lon_dict, lat_dict, lon_vec_dict, and lat_vec_dict. It also has the
+    bin_edges and otdt, which are the same for all sections. See get_sz()
+    for weighted.
+
+    If Nproc > 1 the calling script has to have its work inside an
+    if __name__ == '__main__': block.
+    """
+    task_list = [(sn, in_dir / (sn + '.nc'), sect_df.loc[sect_df.sn==sn,:], S, G, cache_dir,
+        weighted) for sn in sect_list]
+    if Nproc > 1:
+        with Pool(Nproc) as pool:
+            out_list = list(pool.imap_unordered(get_section, task_list))
+    else:
+        out_list = [get_section(task) for task in task_list]
+    out_dict = dict(out_list)
+    D = dict()
+    for k in ['stz', 'Qprism', 'ustar2', 'H', 'lon', 'lat', 'lon_vec', 'lat_vec']:
+        D[k + '_dict'] = {sn: out_dict[sn][k] for sn in sect_list}
+    D['bin_edges'] = out_dict[sect_list[0]]['bin_edges']
+    D['otdt'] = out_dict[sect_list[0]]['otdt']
+    return D
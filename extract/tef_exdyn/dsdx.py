@@ -14,16 +14,23 @@ import numpy as np
 import pickle
 from time import time
 import pandas as pd
-from scipy.stats import binned_statistic
 import seawater as sw
 
 import matplotlib.pyplot as plt
 from lo_tools import plotting_functions as pfun
 
-from lo_tools import Lfun, zrfun, zfun
+from lo_tools import Lfun, zrfun
 from lo_tools import extract_argfun as exfun
 Ldir = exfun.intro() # this handles the argument passing
 
+# where low-passed fields are cached, see lp_fun.py
+cache_dir = Ldir['parent'] / 'LPM_output' / 'lp_cache'
+
+pth = Ldir['parent'] / 'LPM' / 'extract' / 'tef2'
+if str(pth) not in sys.path:
+    sys.path.append(str(pth))
+import sect_fun
+
 # output location
 out_dir = Ldir['parent'] / 'LPM_output' / 'extract'/ 'tef_exdyn'
 Lfun.make_dir(out_dir)
@@ -76,87 +83,18 @@ print(str(in_dir))
 
 tt00 = time()
 
-svz_dict = dict()
-lon_dict = dict()
-lat_dict = dict()
-lon_vec_dict = dict()
-lat_vec_dict = dict()
-ustar2_lp_dict = dict()
-H_dict = dict()
-
-for sn in sect_list:
-    tt0 = time()
-    print(sn)
-
-    # load fields
-    ds = xr.open_dataset(in_dir / (sn + '.nc'))
-    salt_hourly = ds.salt.values
-    pad = 36
-    salt = zfun.lowpass(salt_hourly, f='godin')[pad:-pad+1:24, :]
-    NT, N, P = salt.shape
-    
-    # make Qprism
-    q = ds['dd'].values * ds['DZ'].values * ds['vel'].values
-    qnet = np.nan * np.ones(q.shape[0])
-    for tt in range(q.shape[0]):
-        qnet[tt] = q[tt,:,:].squeeze().sum()
-    qabs = np.abs(qnet)
-    qabs_lp = zfun.lowpass(qabs, f='godin')[pad:-pad+1:24]
-    Qprism = qabs_lp/2
-    
-    sdf = sect_df.loc[sect_df.sn==sn,:]
-    
-    h = ds.h.values
-    zr, zw = zrfun.get_z(h, 0*h, S) # packed (z,p)
-    zf = zr.flatten() # Note: this does not change with time
-    # what if there is only one p?
-    H_dict[sn] = h.mean()
-    
-    # get section area (ssh=0)
-    dz = np.diff(zw,axis=0)
-    A = np.sum(ds['dd'].values * dz)
-    
-    # and then form time series of ustar^2
-    u = qnet/A
-    Cd = 3e-3
-    ustar2 = Cd * u * u
-    # The factor of 2 implies that we are using the amplitude of the
-    # tidal velocity.
-    # To see this, assume u = Ut * cos(om*t), then
-    # <u^2> = 1/2 Ut^2, and so Ut^2 = 2 * <u^2>.
-    ustar2_lp = 2 * zfun.lowpass(ustar2, f='godin')[pad:-pad+1:24]
-    ustar2_lp_dict[sn] = ustar2_lp
-    
-    # find mean lat and lon (more work than it should be!)
-    lon_vec = np.concatenate((lou[sdf.loc[(sdf.uv=='u'),'i']],lov[sdf.loc[(sdf.uv=='v'),'i']]))
-    lat_vec = np.concatenate((lau[sdf.loc[(sdf.uv=='u'),'j']],lav[sdf.loc[(sdf.uv=='v'),'j']]))
-    lon_vec_dict[sn] = lon_vec
-    lat_vec_dict[sn] = lat_vec
-    lo = np.mean(lon_vec)
-    la = np.mean(lat_vec)
-    lon_dict[sn] = lo
-    lat_dict[sn] = la
-    
-    # Then we want to form a time series of s(z)
-    NZ = 100
-    s_vs_z = np.nan * np.ones((NT,NZ))
-    for tt in range(NT):
-        sf = salt[tt,:,:].squeeze().flatten()
-        # scipy.stats.binned_statistic(x, values, statistic='mean', bins=10, range=None)
-        bs = binned_statistic(zf, sf, statistic='mean', bins=NZ, range=(-500,0))
-        s_vs_z[tt,:] = bs.statistic
-    bin_edges = bs.bin_edges
-    
-    ot = ds['time'].to_numpy()
-    # do a little massaging of ot
-    dti = pd.to_datetime(ot) # a pandas DatetimeIndex with dtype='datetime64[ns]'
-    dt = dti.to_pydatetime() # an array of datetimes
-    ot = np.array([Lfun.datetime_to_modtime(item) for item in dt])
-    ot = ot[pad:-pad+1:24]
-    # also make an array of datetimes to save as the ot variable
-    otdt = np.array([Lfun.modtime_to_datetime(item) for item in ot])
-    
-    svz_dict[sn] = s_vs_z
+G = {'lou':lou, 'lau':lau, 'lov':lov, 'lav':lav}
+D = sect_fun.get_sections(sect_list, in_dir, sect_df, S, G, cache_dir)
+svz_dict = D['stz_dict']
+lon_dict = D['lon_dict']
+lat_dict = D['lat_dict']
+lon_vec_dict = D['lon_vec_dict']
+lat_vec_dict = D['lat_vec_dict']
+ustar2_lp_dict = D['ustar2_dict']
+H_dict = D['H_dict']
+Qprism = D['Qprism_dict'][sect_list[-1]]
+bin_edges = D['bin_edges']
+otdt = D['otdt']
     
 dx, ang = sw.dist([lat_dict[sect_list[0]],lat_dict[sect_list[1]]],
     [lon_dict[sect_list[0]],lon_dict[sect_list[1]]],
@@ -9,13 +9,16 @@ import xarray as xr
 import sys
 #import dask
 
-import subprocess
-
 import matplotlib.pyplot as plt
 from lo_tools import plotting_functions as pfun
 
 Ldir = Lfun.Lstart(gridname='cas6', tag='v0', ex_name = 'live')
 
+pth = Ldir['parent'] / 'LPM' / 'misc'
+if str(pth) not in sys.path:
+    sys.path.append(str(pth))
+import job_fun
+
 fn_list = Lfun.get_fn_list('hourly', Ldir, '2019.07.04', '2019.07.06')
 # length 73
 
@@ -49,7 +52,7 @@ vn_str = ','.join(vn_list)
 
 # do the initial extractions
 N = len(fn_list)
-proc_list = []
+cmd_list_list = []
 tt0 = time()
 for ii in range(N):
     fn = fn_list[ii]
@@ -66,28 +69,9 @@ for ii in range(N):
     elif Ldir['bot']:
         cmd_list1 += ['-d','s_rho,0']
     cmd_list1 += ['-O', str(fn), str(out_fn)]
-    proc = Po(cmd_list1, stdout=Pi, stderr=Pi)
-    proc_list.append(proc)
-
-    # screen output about progress
-    if (np.mod(ii,10) == 0) and ii>0:
-        print(str(ii), end=', ')
-        sys.stdout.flush()
-    if (np.mod(ii,50) == 0) and (ii > 0):
-        print('') # line feed
-        sys.stdout.flush()
-    if (ii == N-1):
-        print(str(ii))
-        sys.stdout.flush()
-
-    # Nproc controls how many ncks subprocesses we allow to stack up
-    # before we require them all to finish.
-    if ((np.mod(ii,Ldir['Nproc']) == 0) and (ii > 0)) or (ii == N-1):
-        for proc in proc_list:
-            proc.communicate()
-        # make sure everyone is finished before continuing
-        proc_list = []
-    ii += 1
+    cmd_list_list.append(cmd_list1)
+# Nproc controls how many ncks subprocesses we keep running at once.
+job_list = job_fun.run_jobs(cmd_list_list, Ldir['Nproc'])
 print(' Time to for initial extraction = %0.2f sec' % (time()- tt0))
 sys.stdout.flush()
 
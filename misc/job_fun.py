@@ -0,0 +1,111 @@
+"""
+Functions for running a lot of subprocess jobs at once.
+
+Our old pattern was to launch Nproc jobs with Popen and then wait on all of
+them with communicate() before launching the next Nproc, so one slow job left
+the other cores idle. run_jobs() instead keeps Nproc jobs running all the time,
+starting a new one as soon as any finishes.
+
+Use it from another directory like this:
+
+pth = Ldir['parent'] / 'LPM' / 'misc'
+if str(pth) not in sys.path:
+    sys.path.append(str(pth))
+import job_fun
+"""
+
+from subprocess import Popen as Po
+from tempfile import TemporaryFile
+from time import time, sleep
+import sys
+import numpy as np
+
+def start_job(job):
+    """
+    Start the job dict job. The stdout and stderr go to temporary files, not
+    pipes, because a job that writes a lot to a pipe nobody is reading from
+    will hang.
+    """
+    job['stdout_f'] = TemporaryFile()
+    job['stderr_f'] = TemporaryFile()
+    job['proc'] = Po(job['cmd_list'], stdout=job['stdout_f'], stderr=job['stderr_f'],
+        cwd=job['cwd'])
+    job['ntry'] += 1
+    job['t0'] = time()
+
+def finish_job(job):
+    """
+    Collect the results of a finished job, and clean up.
+    """
+    job['time'] = time() - job['t0']
+    job['returncode'] = job['proc'].returncode
+    for k in ['stdout', 'stderr']:
+        f = job.pop(k + '_f')
+        f.seek(0)
+        job[k] = f.read().decode()
+        f.close()
+    job.pop('proc')
+
+def run_jobs(cmd_list_list, Nproc, retries=1, cwd=None, poll_dt=0.05, verbose=True):
+    """
+    Run the commands in cmd_list_list (each a cmd_list, as you would pass to
+    Popen) with Nproc running at once, and a new one started as soon as
+    any finishes. A job that returns a nonzero code is started again, up
+    to retries more times.
+
+    Returns a list, in the same order as cmd_list_list, of dicts with the
+    cmd_list, returncode, stdout and stderr (strings), the number of tries
+    ntry, and the run time [sec] of the last try. Any jobs that failed in
+    the end have their stderr printed.
+    """
+    N = len(cmd_list_list)
+    job_list = [{'cmd_list':cmd_list, 'cwd':cwd, 'ntry':0} for cmd_list in cmd_list_list]
+    queue = list(range(N))
+    running = []
+    ndone = 0
+    busy_time = 0 # total time of all tries [sec]
+    tt0 = time()
+    while (len(queue) > 0) or (len(running) > 0):
+        # keep Nproc jobs running
+        while (len(queue) > 0) and (len(running) < Nproc):
+            ii = queue.pop(0)
+            start_job(job_list[ii])
+            running.append(ii)
+        sleep(poll_dt)
+        for ii in running.copy():
+            job = job_list[ii]
+            if job['proc'].poll() is None:
+                continue
+            running.remove(ii)
+            finish_job(job)
+            busy_time += job['time']
+            if (job['returncode'] != 0) and (job['ntry'] <= retries):
+                if verbose:
+                    print('\n - retrying job %d (returncode = %d)' % (ii, job['returncode']))
+                    sys.stdout.flush()
+                queue.append(ii)
+                continue
+            ndone += 1
+            # Print screen output about progress.
+            if verbose:
+                if (np.mod(ndone,10) == 0) and ndone>0:
+                    print(str(ndone), end=', ')
+                    sys.stdout.flush()
+                if (np.mod(ndone,50) == 0) and (ndone > 0):
+                    print('') # line feed
+                    sys.stdout.flush()
+    wall_time = time() - tt0
+    fail_list = [ii for ii in range(N) if job_list[ii]['returncode'] != 0]
+    if verbose:
+        print('\n%d jobs done in %0.2f sec (%0.2f jobs/sec)' % (N, wall_time, N/max(wall_time,1e-6)))
+        print(' mean job time = %0.2f sec, core utilization = %d%%'
+            % (busy_time/max(N,1), 100*busy_time/max(Nproc*wall_time,1e-6)))
+        for ii in fail_list:
+            print('\n - job %d failed after %d tries: %s' % (ii, job_list[ii]['ntry'],
+                ' '.join([str(item) for item in job_list[ii]['cmd_list']])))
+            print(job_list[ii]['stderr'])
+        sys.stdout.flush()
+    for job in job_list:
+        job.pop('cwd')
+        job.pop('t0')
+    return job_list
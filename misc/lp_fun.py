@@ -0,0 +1,112 @@
+"""
+A disk cache for low-passed, subsampled time series from extractions.
+
+Lots of our analysis code loads an hourly section or mooring extraction and
+does something like
+
+salt = zfun.lowpass(ds.salt.values, f='godin')[pad:-pad+1:24, :]
+
+every time it is run, which for a year-long section is most of the run time.
+get_lp() does the same thing, but saves the result in cache_dir the first time
+and just loads it after that. The cache file name is a hash of the source
+file, variable, filter and subsampling, and we also save the size and
+modification time of the source file, so if the extraction is redone the
+cached result is recalculated.
+
+For fields we derive from the extraction (like density) pass a function of
+the open Dataset that calculates the field. It is only called if there is no
+good cache file, so a cache hit skips all the reading and calculating, and
+its code is part of the cache file name, so editing it makes a new cache.
+
+Use it from another directory like this:
+
+pth = Ldir['parent'] / 'LPM' / 'misc'
+if str(pth) not in sys.path:
+    sys.path.append(str(pth))
+import lp_fun
+cache_dir = Ldir['parent'] / 'LPM_output' / 'lp_cache'
+"""
+
+import numpy as np
+import xarray as xr
+import hashlib
+from pathlib import Path
+from lo_tools import Lfun, zfun
+
+def get_stamp(fn):
+    """
+    Size and modification time of the file fn, used to tell if it has changed.
+    """
+    st = Path(fn).stat()
+    return np.array([st.st_size, st.st_mtime_ns])
+
+def get_code_key(co):
+    """
+    A string made from the code object co (e.g. f.__code__ for a function f)
+    that changes if the code is edited, including any functions or lambdas
+    defined inside it, but not functions it calls.
+    """
+    key = [co.co_code.hex(), co.co_names]
+    for c in co.co_consts:
+        if hasattr(c, 'co_code'):
+            key.append(get_code_key(c))
+        else:
+            key.append(repr(c))
+    return str(key)
+
+def get_cache_fn(cache_dir, fn, vn, sl, lp_dict, derivation=None):
+    """
+    The cache file for variable vn from source file fn, with the filter
+    settings lp_dict and subsampling slice sl. derivation is a string that
+    identifies how a derived field was calculated (see get_lp()).
+    """
+    key = str([str(Path(fn).resolve()), vn, sl.start, sl.stop, sl.step,
+        sorted(lp_dict.items()), derivation])
+    return Path(cache_dir) / (hashlib.md5(key.encode()).hexdigest() + '.npz')
+
+def get_lp(cache_dir, fn, vn, v=None, sl=slice(36, -35, 24), version=None, **lp_dict):
+    """
+    Low-pass variable vn from the extraction fn (along its first axis, which
+    must be time) and subsample it with the slice sl. The default slice is
+    [pad:-pad+1:24] with pad = 36, which gives daily values at noon after a
+    godin filter. The keyword arguments lp_dict are passed to zfun.lowpass(),
+    and the default is f='godin'.
+
+    For things we calculate from the extraction, like density, v is a
+    function that takes the open Dataset and returns the field, and vn is
+    just the name for the cache. v is only called on a cache miss, and the
+    cache key includes its code (see get_code_key()), so editing v gives a
+    new cache. Changes to the functions v calls are not seen, so if you edit
+    those change the string version, which is also part of the key.
+
+    v may also be an array that was already calculated. Then the cache can
+    not tell how it was made, so change version (or vn) whenever that changes.
+    """
+    if len(lp_dict) == 0:
+        lp_dict = {'f':'godin'}
+    Lfun.make_dir(cache_dir)
+    if callable(v):
+        derivation = [version, get_code_key(v.__code__)]
+    elif v is not None:
+        derivation = [version, 'array']
+    else:
+        derivation = version
+    cache_fn = get_cache_fn(cache_dir, fn, vn, sl, lp_dict, derivation=str(derivation))
+    stamp = get_stamp(fn)
+    if cache_fn.is_file():
+        C = np.load(cache_fn)
+        if (C['stamp'] == stamp).all():
+            return C['v_lp']
+    if (v is None) or callable(v):
+        ds = xr.open_dataset(fn)
+        if v is None:
+            v = ds[vn].values
+        else:
+            v = v(ds)
+        ds.close()
+    v_lp = zfun.lowpass(v, **lp_dict)[sl]
+    # write to a temporary file first so a crash does not leave a bad cache file
+    temp_fn = cache_fn.parent / ('temp_' + cache_fn.name)
+    np.savez(temp_fn, v_lp=v_lp, stamp=stamp)
+    temp_fn.replace(cache_fn)
+    return v_lp
@@ -0,0 +1,95 @@
+"""
+Benchmark of the memory allocated and time taken per call to update_v(),
+comparing the case where the spec and work arrays are rebuilt on every call
+(the old behavior) to the case where they are built once and passed in.
+Then compares whole runs with fixed and adaptive time steps.
+
+Run from this directory, e.g.
+python benchmark.py
+"""
+
+import numpy as np
+import tracemalloc
+import time
+import npzd_equations
+from importlib import reload
+reload(npzd_equations)
+
+# choices
+modname = 'fennel'
+ncol = 100 # number of columns in the ensemble
+nt = 200 # number of time steps to time
+
+# z-coordinates (bottom to top, positive up)
+H = 30 # max depth [m]
+N = 30 # number of vertical grid cells
+Dz = H/N
+z_w = np.arange(-H,Dz,Dz)
+z_rho = z_w[:-1] + Dz/2
+Z = {'Dz': Dz, 'N': N, 'z_rho': z_rho, 'z_w': z_w}
+dt = 0.01 # time step [days]
+
+Env = {'temp': 10 * np.ones(N), 'salt': 32 * np.ones(N), 'swrad0': 500 * np.ones((ncol, 1))}
+
+def get_v():
+    v = dict()
+    v['Phy'] = 0.01 * np.ones((ncol, N))
+    v['Chl'] = 2.5 * v['Phy'].copy()
+    v['Zoo'] = 0.1 * v['Phy'].copy()
+    v['SDet'] = 0 * np.ones((ncol, N))
+    v['LDet'] = 0 * np.ones((ncol, N))
+    v['NO3'] = 20 * np.ones((ncol, N))
+    v['NH4'] = 0 * np.ones((ncol, N))
+    return v
+
+for prealloc in [False, True]:
+    v = get_v()
+    denitrified = np.zeros(ncol)
+    if prealloc:
+        S = npzd_equations.get_spec(modname, Z, Env)
+        W = npzd_equations.get_work(S, v['Phy'].shape)
+    else:
+        S = None
+        W = None
+    # warm up
+    v, denitrified = npzd_equations.update_v(v, denitrified, modname, dt, Z, Env, S=S, W=W)
+    
+    # memory allocated during a step, beyond what is there at the start
+    tracemalloc.start()
+    alloc_list = []
+    for it in range(10):
+        tracemalloc.reset_peak()
+        mem0 = tracemalloc.get_traced_memory()[0]
+        v, denitrified = npzd_equations.update_v(v, denitrified, modname, dt, Z, Env, S=S, W=W)
+        alloc_list.append(tracemalloc.get_traced_memory()[1] - mem0)
+    tracemalloc.stop()
+    
+    # time per step
+    tt0 = time.time()
+    for it in range(nt):
+        v, denitrified = npzd_equations.update_v(v, denitrified, modname, dt, Z, Env, S=S, W=W)
+    T = (time.time() - tt0)/nt
+    
+    print('\nprealloc = %s' % (str(prealloc)))
+    print(' peak memory allocated per step = %d bytes (one profile array = %d bytes)'
+        % (np.max(alloc_list), v['Phy'].nbytes))
+    print(' time per step = %0.1f microseconds' % (T*1e6))
+
+# Wall time and accuracy of 1-year runs with fixed and adaptive time steps,
+# compared to a fixed step run with dt = 0.001. ncalls is the number of calls
+# to update_v() or update_v_split(), which mostly sets the cost.
+import npzd_fun
+reload(npzd_fun)
+tmax = 365 # [days]
+for modname in ['mix0', 'fennel']:
+    ref = npzd_fun.run(npzd_fun.get_info({'modname':modname, 'tmax':tmax, 'dt':0.001}))
+    print('\n' + modname)
+    for kw in [{'dt':0.01}, {'dt':0.005}, {'dt':0.01, 'adaptive':True},
+            {'dt':0.01, 'adaptive':True, 'atol':0.001}]:
+        info = npzd_fun.get_info({'modname':modname, 'tmax':tmax} | kw)
+        tt0 = time.time()
+        out = npzd_fun.run(info)
+        T = time.time() - tt0
+        err = np.max([np.nanmax(np.abs(out['V'][vn] - ref['V'][vn])) for vn in ['Phy', 'Zoo', 'NO3']])
+        print(' %s: time = %0.2f sec, max error = %0.3f [mmol N m-3]' % (str(kw), T, err))
+        print('  ncalls = %d, nreject = %d' % (out['ncalls'], out['nreject']))
@@ -5,119 +5,79 @@ is done using the backward-implicit method from ROMS.
 This framework is designed to work for both the Fennel and Banas models.
 """
 
-import numpy as np
 import matplotlib.pyplot as plt
+import netCDF4 as nc
 from lo_tools import plotting_functions as pfun
-import npzd_equations
+import npzd_fun
 from importlib import reload
-reload(npzd_equations)
+reload(npzd_fun)
+
+info = npzd_fun.get_info()
 
 # set the model to use: 'banas', 'fennel', etc.
-modname = 'mix0'
+info['modname'] = 'mix0'
+
+# number of water columns to run at once as an ensemble (e.g. for sensitivity
+# work), all advanced together by each call to update_v()
+info['ncol'] = 1
 
-# z-coordinates (bottom to top, positive up)
-H = 30 # max depth [m]
-N = 30 # number of vertical grid cells
-Dz = H/N
-z_w = np.arange(-H,Dz,Dz)
-z_rho = z_w[:-1] + Dz/2
-Z = {'Dz': Dz, 'N': N, 'z_rho': z_rho, 'z_w': z_w}
+# z-coordinates
+info['H'] = 30 # max depth [m]
+info['N'] = 30 # number of vertical grid cells
 
 # time
-tmax = 20 # max time [days]
-dt = 0.01 # time step [days]
+info['tmax'] = 20 # max time [days]
+info['dt'] = 0.01 # time step [days]
+# Set to True to use adaptive time steps between dt and info['dt_max'], with
+# the step size set by a local error estimate (see npzd_fun.step_adaptive()).
+# For the same accuracy fixed steps are cheaper, see benchmark.py.
+info['adaptive'] = False
 
-# number of time steps
-nt = int(np.round(tmax/dt))
-# number of time steps between saves of profiles
-ntp = int(np.round((tmax/10)/dt))
-Ntp = int(np.round((nt/ntp))) + 1 # total number of saved profiles
-# number of time steps between saves of net amounts (reservoirs)
-ntr = int(np.round((tmax/100)/dt))
-Ntr = int(np.round((nt/ntr))) + 1 # total number of saved net amounts
+# surface downward shortwave radiation [W m-3], which can also differ between
+# columns, e.g. np.linspace(100, 500, info['ncol']).reshape(info['ncol'], 1)
+info['swrad0'] = 500
 
-# initialize dict of output arrays
-vn_list = ['Phy', 'Chl', 'Zoo', 'SDet', 'LDet', 'NO3', 'NH4']
-Omat = np.nan * np.ones((Ntp, N))
-V = dict()
-for vn in vn_list:
-    V[vn] = Omat.copy()
-    
-# initialize dict of reservoir time series
-vnr_list = ['Phy', 'Zoo', 'SDet', 'LDet', 'NO3', 'NH4', 'Lost']
-R = dict()
-for vn in vnr_list:
-    R[vn] = np.nan * np.ones(Ntr)
-    
-# intial conditions, all [mmol N m-3], except Chl which is [mg Chl m-3]
-v = dict()
-v['Phy'] = 0.01 * np.ones(N)
-v['Chl'] = 2.5 * v['Phy'].copy()
-v['Zoo'] = 0.1 * v['Phy'].copy()
-v['SDet'] = 0 * np.ones(N)
-v['LDet'] = 0 * np.ones(N)
-v['NO3'] = 20 * np.ones(N)
-v['NH4'] = 0 * np.ones(N)
+# See npzd_fun.get_info() for the initial conditions and other settings.
 
-temp = 10 * np.ones(N) # potential temperature [deg C] vs. z
-salt = 32 * np.ones(N) # salinity [psu] vs. z
-swrad0 = 500 # surface downward shortwave radiation [W m-3]
-Env = {'temp': temp, 'salt': salt, 'swrad0': swrad0}
+# Optionally stream the saved profiles and reservoirs to a NetCDF file as the
+# run proceeds, instead of keeping them in memory, e.g. for long runs.
+# Set info['float32'] = True to save space.
+out_fn = None
 
-denitrified = 0
-TRvec = []
-it = 0
-itp = ntp
-Itp = 0
-itr = ntr
-Itr = 0
-while it <= nt:
-    
-    # save output vectors if it is time
-    if itp == ntp:
-        print('t = %0.2f days' % (it*dt))
-        for vn in vn_list:
-            V[vn][Itp,:] = v[vn]
-        # report on global conservation
-        net_N = 0
-        for vn in vn_list:
-            if vn == 'Chl':
-                pass
-            else:
-                net_N += np.sum(Dz * v[vn])
-        net_N += denitrified
-        print(' mean N = %0.7f [mmol N m-3]' % (net_N/H))
-        itp = 0
-        Itp += 1
-    # save reservoir output if it is time
-    if itr == ntr:
-        TRvec.append(it*dt)
-        for vn in vnr_list:
-            if vn == 'Lost':
-                R[vn][Itr] = denitrified
-            else:
-                R[vn][Itr] = np.sum(Dz * v[vn])
-        itr = 0
-        Itr += 1
-    
-    # integrate forward one time step
-    v, denitrified = npzd_equations.update_v(v, denitrified, modname, dt, Z, Env)
-        
-    it += 1
-    itp += 1
-    itr += 1
+out = npzd_fun.run(info, verbose=True, out_fn=out_fn)
+
+modname = info['modname']
+if out_fn is None:
+    V = out['V']
+    R = out['R']
+else:
+    ds = nc.Dataset(out_fn)
+    V = dict()
+    for vn in npzd_fun.vn_list:
+        V[vn] = ds[vn][:]
+    R = dict()
+    for vn in npzd_fun.vnr_list:
+        R[vn] = ds['R_' + vn][:]
+    ds.close()
+TRvec = out['TRvec']
+z_rho = out['z_rho']
+Ntp = len(out['TPvec'])
+vnr_list = npzd_fun.vnr_list
         
 # plotting
 #plt.close('all')
 pfun.start_plot(fs=8, figsize=(16,6))
 
+# which column of the ensemble to plot
+icol = 0
+
 if True:
     # Vertical profiles
     fig, axes = plt.subplots(nrows=1, ncols=len(V.keys()), squeeze=False)
     ii = 0
     for vn in V.keys():
         ax = axes[0,ii]
-        vv = V[vn]
+        vv = V[vn][:,icol,:]
         for tt in range(Ntp):
             ax.plot(vv[tt,:], z_rho, lw=(tt+1)/4)
             if vn == 'NO3':
@@ -138,7 +98,7 @@ if True:
         if vn == 'NO3':
             pass
         else:
-            ax.plot(TRvec, R[vn], label=vn, lw=2)
+            ax.plot(TRvec, R[vn][:,icol], label=vn, lw=2)
     ax.legend()
     ax.grid(True)
     ax.set_title(modname)
@@ -146,7 +106,7 @@ if True:
     ax.set_ylabel('Net N [mmol N m-2]')
     ax = fig.add_subplot(212)
     for vn in ['NO3']:
-        ax.plot(TRvec, R[vn], label=vn, lw=2)
+        ax.plot(TRvec, R[vn][:,icol], label=vn, lw=2)
     ax.legend()
     ax.grid(True)
     ax.set_xlabel('Days')
@@ -1,12 +1,38 @@
 import numpy as np
+import sys
+from types import SimpleNamespace
 import parameters as p
 from importlib import reload
 reload(p)
 
+def get_mean_Chl(Chl, z_w):
+    """
+    Mean chlorophyll between each cell center and the surface, weighting the
+    cell itself by half its thickness. Uses a reverse cumulative sum so the
+    cost is O(N) per column, and works for uneven z_w.
+    
+    Input:
+    Chl = chlorophyll profile, (N) or (ncol, N), packed bottom-to-top [mg Chl m-3]
+    z_w = vertical positions of cell boundaries (N+1) [m]
+    
+    Output:
+    mean_Chl = same shape as Chl [mg Chl m-3]
+    """
+    dz = np.diff(z_w)
+    dzChl = dz * Chl
+    # integrals from the bottom of each cell to the surface
+    Chl_int = np.cumsum(dzChl[..., ::-1], axis=-1)[..., ::-1]
+    dz_int = np.cumsum(dz[::-1])[::-1]
+    # then only count the upper half of each cell
+    mean_Chl = (Chl_int - 0.5*dzChl) / (dz_int - 0.5*dz)
+    return mean_Chl
+
 def get_E(Chl, Z, Env, modname):
     """
     Profile of photosynthetically available radiation vs. z
-    NOTE: all inputs except swrad0 must be vectors (z)
+    NOTE: all inputs except swrad0 must be vectors (z), or for an ensemble
+    of columns they may be arrays of shape (ncol, N) with z as the last axis,
+    in which case swrad0 may be a scalar or an array of shape (ncol, 1)
     NOTE: we assume z_rho, z_w, and Chl are packed bottom-to-top
     NOTE: corrected Chl integral to use mean, as per notes in ROMS Forum:
     https://www.myroms.org/forum/viewtopic.php?p=2444&hilit=AttChl+units#p2444
@@ -21,217 +47,643 @@ def get_E(Chl, Z, Env, modname):
     Output:
     E = photosynthetically available radiation [W m-2]
     """
-    dz = np.diff(Z['z_w'])
-    N = len(Chl)
-    mean_Chl = np.zeros(N)
-    for ii in range(N):
-        this_dz = dz[ii:]
-        this_dz[0] *= 0.5
-        this_Chl = Chl[ii:]
-        mean_Chl[ii] = np.sum(this_dz * this_Chl) / np.sum(this_dz)
+    mean_Chl = get_mean_Chl(Chl, Z['z_w'])
     if modname in ['banas', 'mix0']:
         AttSFW_nb = p.AttSW_nb - p.AttFW_nb * (Env['salt'] - 32)
-        E = Env['swrad0'] * p.PARfrac * np.exp( Z['z_rho'] * (AttSFW_nb + p.AttChl_nb*mean_Chl))
+        Att = AttSFW_nb + p.AttChl_nb*mean_Chl
     elif modname == 'fennel':
-        E = Env['swrad0'] * p.PARfrac * np.exp( Z['z_rho'] * (p.AttSW + p.AttChl*mean_Chl))
+        Att = p.AttSW + p.AttChl*mean_Chl
+    E = Env['swrad0'] * p.PARfrac * np.exp(Z['z_rho'] * Att)
     return E
     
-def sink(vn, C, max_denitrification, Wsink, dt, Z):
+def get_sink_ops(Wsink, dt, z_w, shape=None):
+    """
+    Precompute the shift indices and weights for sinking a stack of tracers
+    with speeds Wsink (ntracer) [m d-1] for one time step dt [days], on the
+    grid z_w (N+1), packed bottom-to-top and possibly non-uniform.
+    
+    Each new cell value is the mean of the old profile over the interval that
+    sinks into that cell, so:
+    Cnew[t,...,k] = sum over m of wt[t,k,m] * C[t,...,ind[t,k,m]]
+    and what leaves through the bottom [amount m-2] is:
+    flux[t,...] = sum over j of lost[t,j] * C[t,...,j]
+    which conserves mass exactly.
+    
+    If shape, the shape of one tracer array, (N) or (ncol, N), is given then
+    we also make the flattened indices and full-shape weights used by
+    sink_stack_inplace().
+    """
+    Wsink = np.atleast_1d(np.array(Wsink, dtype=float))
+    if np.any(Wsink < 0):
+        print('Error: Wsink must be positive (downward)')
+        sys.exit()
+    NT = len(Wsink)
+    dz = np.diff(z_w)
+    N = len(dz)
     h = Wsink * dt
-    nn = int(np.floor(h / Z['Dz']))
-    delta = h - nn * Z['Dz']
-    Next = nn + 2
-    NN = Z['N'] + Next
-    Cext = np.concatenate((C, np.zeros(Next)))
-    Cnew = Cext[nn:nn+Z['N']]*(Z['Dz'] - delta)/Z['Dz'] + Cext[nn+1:nn+Z['N']+1]*(delta/Z['Dz'])
-    Cnet_old = Z['Dz'] * np.sum(C)
-    Cnet_new = Z['Dz'] * np.sum(Cnew)
-    Cnet_lost = Cnet_old - Cnet_new
+    # overlap [m] of old cell j with the interval that sinks into new cell k,
+    # packed (NT, k, j)
+    lo = z_w[:-1].reshape(1,N,1) + h.reshape(NT,1,1)
+    hi = z_w[1:].reshape(1,N,1) + h.reshape(NT,1,1)
+    O = np.minimum(hi, z_w[1:].reshape(1,1,N)) - np.maximum(lo, z_w[:-1].reshape(1,1,N))
+    O = np.maximum(O, 0)
+    is_source = O > 0
+    # the old cells that sink into each new cell are contiguous, starting at j0
+    j0 = np.argmax(is_source, axis=-1)
+    M = max(1, int(is_source.sum(axis=-1).max()))
+    ind = j0.reshape(NT,N,1) + np.arange(M).reshape(1,1,M)
+    beyond = ind > N-1
+    ind[beyond] = N-1
+    wt = np.take_along_axis(O, ind, axis=-1) / dz.reshape(1,N,1)
+    wt[beyond] = 0
+    # the length of each old cell that sinks below z_w[0] [m]
+    lost = np.minimum(np.maximum(z_w[0] - (z_w[:-1].reshape(1,N) - h.reshape(NT,1)), 0), dz.reshape(1,N))
+    Sk = {'NT': NT, 'M': M, 'ind': ind, 'wt': wt, 'lost': lost}
+    if shape is not None:
+        # indices into a flattened (NT, ncol, N) stack, and full-shape weights,
+        # both packed (M, NT, ncol, N)
+        col_shape = tuple(shape[:-1])
+        ncol = int(np.prod(col_shape))
+        base = (np.arange(NT*ncol) * N).reshape((NT,) + col_shape + (1,))
+        sh = (NT,) + (1,)*len(col_shape) + (N,)
+        full_shape = (NT,) + tuple(shape)
+        Sk['flat_ind'] = np.zeros((M,) + full_shape, dtype=int)
+        Sk['wt_full'] = np.zeros((M,) + full_shape)
+        for m in range(M):
+            Sk['flat_ind'][m] = base + ind[:,:,m].reshape(sh)
+            Sk['wt_full'][m] = np.broadcast_to(wt[:,:,m].reshape(sh), full_shape)
+        Sk['lost_full'] = np.broadcast_to(lost.reshape(sh), full_shape).copy()
+    return Sk
+
+def sink_stack(C, Sk):
+    """
+    Sink a stack of tracers C, packed (ntracer, N) or (ntracer, ncol, N),
+    using the operators from get_sink_ops(). Returns the new profiles and
+    the flux out the bottom [amount m-2], packed (ntracer) or (ntracer, ncol).
+    """
+    NT, N = Sk['wt'].shape[:2]
+    sh = (NT,) + (1,)*(C.ndim-2) + (N,)
+    Cnew = np.zeros(C.shape)
+    for m in range(Sk['M']):
+        Cnew += Sk['wt'][:,:,m].reshape(sh) * np.take_along_axis(C, Sk['ind'][:,:,m].reshape(sh), axis=-1)
+    flux = np.sum(Sk['lost'].reshape(sh) * C, axis=-1)
+    return Cnew, flux
+
+def sink_stack_inplace(C, Sk, W):
+    """
+    Allocation-free version of sink_stack() using the work arrays in W.
+    C is the stack W['Csink'], and the results are put in W['Csink_new']
+    and W['sink_flux']. Sk must have been made with the shape argument.
+    """
+    Cf = C.reshape(-1)
+    Cnew = W['Csink_new']
+    tmp = W['Csink_tmp']
+    Cnew.fill(0)
+    for m in range(Sk['M']):
+        np.take(Cf, Sk['flat_ind'][m], out=tmp, mode='clip')
+        tmp *= Sk['wt_full'][m]
+        Cnew += tmp
+    np.multiply(C, Sk['lost_full'], out=tmp)
+    np.sum(tmp, axis=-1, out=W['sink_flux'])
+
+def sink(vn, C, max_denitrification, Wsink, dt, Z):
+    """
+    Sink the profile C a distance Wsink*dt, with z as the last axis so C can
+    be a single column (N) or an ensemble of columns (ncol, N). Whatever leaves
+    through the bottom is added to max_denitrification [concentration in
+    the bottom cell], which is a scalar or an array of shape (ncol).
+    
+    This is for a single tracer. For several tracers it is faster to stack
+    them and use get_sink_ops() and sink_stack() directly.
+    """
+    Sk = get_sink_ops([Wsink], dt, Z['z_w'])
+    Cnew, flux = sink_stack(C.reshape((1,) + C.shape), Sk)
     if vn == 'Chl':
         pass
     else:
-        max_denitrification += Cnet_lost / Z['Dz']
-    return Cnew, max_denitrification
+        max_denitrification = max_denitrification + flux[0] / np.diff(Z['z_w'])[0]
+    return Cnew[0], max_denitrification
 
-def update_v(v, denitrified, modname, dt, Z, Env):
+def get_spec(modname, Z, Env, P=None):
+    """
+    Compile a model specification for modname ('banas', 'fennel', 'mix0').
     
-    # In all the processes below we organize the backward-implicit integration
-    # around the variable that is being taken from (e.g. NO3 for phytoplankton growth).
-    # Hence we always write the "cff" term as: dt * rate factor * variable being taken from.
-    # This can sometimes be confusing because it is not how the terms are grouped
-    # when the equations are presented in the papers, but it works great for the numerics!
+    This is built once per run, before the time loop. It holds all the
+    coefficients that do not change during a run (including those that
+    depend on Env, so it must be rebuilt if Env changes) and the ordered
+    list of process functions that update_v() calls each time step. This
+    way the time loop does no string comparisons and a new model variant
+    only needs a new branch here.
     
-    # phytoplankgon growth
-    # light profile
-    E = get_E(v['Chl'], Z, Env, modname)
-    # light response curve
+    Each process function has the form fun(v, W, S, dt, Z, Env), where W is
+    the dict of preallocated work arrays from get_work(). The processes
+    update the arrays in v in place.
+    
+    P is an optional dict of values to use in place of those in
+    parameters.py, e.g. {'ZooGR_nb': 3.0}, used for parameter sweeps.
+    """
+    if P is None:
+        pp = p
+    else:
+        # copy of the parameters module with some values replaced
+        pp = SimpleNamespace(**{k: getattr(p, k) for k in dir(p) if not k.startswith('_')})
+        for k in P.keys():
+            if not hasattr(pp, k):
+                print('Error: unknown parameter ' + k)
+                sys.exit()
+            setattr(pp, k, P[k])
+    S = dict()
+    S['modname'] = modname
     if modname in ['banas', 'mix0']:
+        # light
+        S['Att0'] = pp.AttSW_nb - pp.AttFW_nb * (Env['salt'] - 32)
+        S['AttChl'] = pp.AttChl_nb
+        # light response curve
         mu_max = 1.7 # max growth rate [d-1]
-        f = p.PhyIS_nb * E / np.sqrt(mu_max**2 + (p.PhyIS_nb * E)**2)
+        S['PhyIS'] = pp.PhyIS_nb
+        # nutrient uptake
+        S['K3'] = 1 / pp.K_NO3_nb
+        S['K4'] = 1 / pp.K_NH4_nb
+        # grazing
+        S['ZooGR'] = pp.ZooGR_nb
+        S['K_Phy'] = pp.K_Phy_nb
+        S['graze_Zoo'] = pp.ZooAE_N_nb
+        S['graze_SDet'] = pp.ZooEg_N_nb * (1 - pp.ZooAE_N_nb)
+        S['graze_N'] = (1 - pp.ZooEg_N_nb) * (1 - pp.ZooAE_N_nb)
+        # mortality
+        S['PhyMR'] = pp.PhyMR_nb
+        S['ZooMR'] = pp.ZooMR_nb
+        # coagulation
+        S['CoagR'] = pp.CoagR_nb
+        # remineralization
+        S['SDeRRN'] = pp.SDeRRN_nb
+        S['LDeRRN'] = pp.LDeRRN_nb
+        # sinking
+        S['sink_vn'] = ['SDet', 'LDet']
+        S['Wsink'] = np.array([pp.wSDet_nb, pp.wLDet_nb])
+        S['sink_N'] = [True, True]
+        S['chi_nb'] = 1.2 # loss of nitrate to sediments [mmol NO3 m-2 d-1]
     elif modname == 'fennel':
+        S['Att0'] = pp.AttSW
+        S['AttChl'] = pp.AttChl
         mu_0 = 0.59
         mu_max = mu_0 * 1.066**Env['temp']
-        f = p.PhyIS * E / np.sqrt(mu_max**2 + (p.PhyIS * E)**2)
-    # nutrient limitation curve and phytoplankton growth
-    if modname == 'banas':
-        K3min = 1 / p.K_NO3_nb
-        K3 = K3min + 2*np.sqrt(K3min * v['NO3'])
-        cff3 = dt * mu_max * f * (v['Phy'] / (K3 + v['NO3']))
-        v['NO3'] = v['NO3'] / (1 + cff3)
-        v['Phy'] = v['Phy'] + cff3 * v['NO3']
-    elif modname == 'fennel':
-        K3 = 1 / p.K_NO3 # note that these are given as inverse in the dot-in
-        K4 = 1 / p.K_NH4
-        cff3 = dt * mu_max * f * (v['Phy'] / (K3 + v['NO3'])) * (K4 / (K4 + v['NH4']))
-        cff4 = dt * mu_max * f * (v['Phy'] / (K4 + v['NH4']))
-        v['NO3'] = v['NO3'] / (1 + cff3)
-        v['NH4'] = v['NH4'] / (1 + cff4)
-        v['Phy'] = v['Phy'] + cff3 * v['NO3'] + cff4 * v['NH4']
-    elif modname == 'mix0':
-        K3 = 1 / p.K_NO3_nb
-        K4 = 1 / p.K_NH4_nb
-        cff3 = dt * mu_max * f * (v['Phy'] / (K3 + v['NO3'])) * (K4 / (K4 + v['NH4']))
-        cff4 = dt * mu_max * f * (v['Phy'] / (K4 + v['NH4']))
-        v['NO3'] = v['NO3'] / (1 + cff3)
-        v['NH4'] = v['NH4'] / (1 + cff4)
-        v['Phy'] = v['Phy'] + cff3 * v['NO3'] + cff4 * v['NH4']
-    # chlorophyll growth
-    if modname in ['banas', 'mix0']:
-        v['Chl'] = 2.5 * v['Phy']
-    elif modname == 'fennel':
-        mu3 = mu_max * f * (v['NO3'] / (K3 + v['NO3'])) * (K4 / (K4 + v['NH4']))
-        mu4 = mu_max * f * (v['NH4'] / (K4 + v['NH4']))
-        mu = mu3 + mu4
-        Chl2Phy = v['Chl'] / v['Phy']
+        S['PhyIS'] = pp.PhyIS
+        S['K3'] = 1 / pp.K_NO3 # note that these are given as inverse in the dot-in
+        S['K4'] = 1 / pp.K_NH4
         C_AtWt = 12 # Carbon atomic weight [g C / mol C]
-        rho_Chl = p.PhyCN * C_AtWt * p.Chl2C_m * mu * v['Phy'] / (p.PhyIS * E * v['Chl'])
-        v['Chl'] = v['Chl'] + rho_Chl * Chl2Phy * (cff3 * v['NO3'] + cff4 * v['NH4'])
+        S['rho_Chl_fac'] = pp.PhyCN * C_AtWt * pp.Chl2C_m / pp.PhyIS
+        S['ZooGR'] = pp.ZooGR
+        S['K_Phy'] = pp.K_Phy
+        S['graze_Zoo'] = pp.ZooAE_N
+        S['graze_SDet'] = 1 - pp.ZooAE_N
+        S['ZooBM'] = pp.ZooBM
+        S['ZooER_AE'] = pp.ZooER * pp.ZooAE_N
+        S['PhyMR'] = pp.PhyMR
+        S['ZooMR'] = pp.ZooMR
+        S['CoagR'] = pp.CoagR
+        S['SDeRRN'] = pp.SDeRRN
+        S['LDeRRN'] = pp.LDeRRN
+        S['sink_vn'] = ['Phy', 'Chl', 'SDet', 'LDet']
+        S['Wsink'] = np.array([pp.wPhy, pp.wPhy, pp.wSDet, pp.wLDet])
+        # which sinking variables count toward the N lost at the bottom
+        S['sink_N'] = [True, False, True, True]
+        S['denit_fac'] = 0.25 # fraction of particle flux at bottom that is returned to NH4, 4/16
+    else:
+        print('Error: unknown modname ' + modname)
+        sys.exit()
+    S['mu_max'] = mu_max
+    S['mu_max2'] = mu_max**2
+    S['E0'] = Env['swrad0'] * pp.PARfrac
+    # grid quantities used to find the mean Chl above each cell
+    S['dz'] = np.diff(Z['z_w'])
+    S['dz_int_half'] = np.cumsum(S['dz'][::-1])[::-1] - 0.5*S['dz']
+    S['z_rho'] = Z['z_rho']
+    S['dz0'] = S['dz'][0] # thickness of the bottom cell
+    # nitrification
+    S['NitriR'] = pp.NitriR
+    S['I_thNH4'] = pp.I_thNH4
+    S['D_p5NH4'] = pp.D_p5NH4
     
-    # grazing by zooplankton
+    # the ordered list of processes, of which the first S['nfast'] (light,
+    # uptake, grazing) are fast and may be subcycled by update_v_split()
     if modname == 'banas':
-        Ing = p.ZooGR_nb * (v['Phy'] * v['Zoo'] / (p.K_Phy_nb + v['Phy']**2))
-        cff = dt * Ing
-        v['Phy'] = v['Phy'] / (1 + cff)
-        v['Zoo'] = v['Zoo'] + p.ZooAE_N_nb * cff * v['Phy']
-        v['SDet'] = v['SDet'] + p.ZooEg_N_nb * (1 - p.ZooAE_N_nb) * cff * v['Phy']
-        v['NO3'] = v['NO3'] + (1 - p.ZooEg_N_nb) * (1 - p.ZooAE_N_nb) * cff * v['Phy']
-    if modname == 'mix0':
-        Ing = p.ZooGR_nb * (v['Phy'] * v['Zoo'] / (p.K_Phy_nb + v['Phy']**2))
-        cff = dt * Ing
-        v['Phy'] = v['Phy'] / (1 + cff)
-        v['Zoo'] = v['Zoo'] + p.ZooAE_N_nb * cff * v['Phy']
-        v['SDet'] = v['SDet'] + p.ZooEg_N_nb * (1 - p.ZooAE_N_nb) * cff * v['Phy']
-        v['NH4'] = v['NH4'] + (1 - p.ZooEg_N_nb) * (1 - p.ZooAE_N_nb) * cff * v['Phy']
+        S['process_list'] = [light, uptake_banas, chl_fixed, graze_nb,
+            phy_mortality, zoo_mortality, coag_nb, remin, sink_nb]
+        S['nfast'] = 4
+        S['graze_to'] = 'NO3'
+        S['remin_to'] = 'NO3'
+    elif modname == 'mix0':
+        S['process_list'] = [light, uptake, chl_fixed, graze_nb,
+            phy_mortality, zoo_mortality, coag_nb, remin, nitrification, sink_nb]
+        S['nfast'] = 4
+        S['graze_to'] = 'NH4'
+        S['remin_to'] = 'NH4'
     elif modname == 'fennel':
-        Ing = p.ZooGR * (v['Phy'] * v['Zoo'] / (p.K_Phy + v['Phy']**2))
-        cff = dt * Ing
-        v['Phy'] = v['Phy'] / (1 + cff)
-        v['Chl'] = v['Chl'] / (1 + cff)
-        v['Zoo'] = v['Zoo'] + p.ZooAE_N * cff * v['Phy']
-        v['SDet'] = v['SDet'] + (1 - p.ZooAE_N) * cff * v['Phy']
+        S['process_list'] = [light, uptake, chl_fennel, graze_fennel, zoo_metabolism,
+            phy_mortality_chl, zoo_mortality, coag_fennel, remin, nitrification, sink_fennel]
+        S['nfast'] = 5
+        S['remin_to'] = 'NH4'
+    return S
+
+def get_work(S, shape):
+    """
+    Allocate the work arrays used by the process functions, once per run.
+    shape is the shape of each tracer array in v: (N) or (ncol, N).
     
+    This includes full-shape copies of the coefficients in S that vary with
+    z or column, because numpy allocates a buffer when an in-place ufunc has
+    to broadcast an array argument.
+    """
+    W = dict()
+    for vn in ['Att0', 'z_rho', 'dz', 'dz_int_half', 'E0', 'mu_max', 'mu_max2']:
+        W[vn] = np.broadcast_to(S[vn], shape).copy()
+    for vn in ['E', 'f', 'cff3', 'cff4', 'a', 'b', 'c', 'Chl_int']:
+        W[vn] = np.zeros(shape)
+    # column arrays, used for things integrated over z
+    for vn in ['max_denitrification', 'denitrification', 'ddenitrified']:
+        W[vn] = np.zeros(shape[:-1])
+    # stacks of the sinking variables
+    NT = len(S['sink_vn'])
+    for vn in ['Csink', 'Csink_new', 'Csink_tmp']:
+        W[vn] = np.zeros((NT,) + tuple(shape))
+    W['sink_flux'] = np.zeros((NT,) + tuple(shape[:-1]))
+    # sinking operators from get_sink_ops(), added for each new dt
+    W['sink_ops'] = dict()
+    W['shape'] = tuple(shape)
+    return W
+
+# In all the processes below we organize the backward-implicit integration
+# around the variable that is being taken from (e.g. NO3 for phytoplankton growth).
+# Hence we always write the "cff" term as: dt * rate factor * variable being taken from.
+# This can sometimes be confusing because it is not how the terms are grouped
+# when the equations are presented in the papers, but it works great for the numerics!
+#
+# All the arithmetic is done in place, using the out= argument of the numpy
+# ufuncs and the scratch arrays W['a'], W['b'], and W['c'], so that a time step
+# allocates no new arrays. The equation being calculated is given in the
+# comment above each block.
+
+def light(v, W, S, dt, Z, Env):
+    a = W['a']
+    E = W['E']
+    f = W['f']
+    # mean_Chl = mean Chl above each cell center (see get_mean_Chl)
+    np.multiply(W['dz'], v['Chl'], out=a)
+    np.cumsum(a[..., ::-1], axis=-1, out=W['Chl_int'][..., ::-1])
+    a *= 0.5
+    np.subtract(W['Chl_int'], a, out=a)
+    a /= W['dz_int_half']
+    # E = E0 * exp(z_rho * (Att0 + AttChl*mean_Chl))
+    a *= S['AttChl']
+    a += W['Att0']
+    a *= W['z_rho']
+    np.exp(a, out=E)
+    E *= W['E0']
+    # f = PhyIS*E / sqrt(mu_max**2 + (PhyIS*E)**2)
+    np.multiply(E, S['PhyIS'], out=a)
+    np.multiply(a, a, out=f)
+    f += W['mu_max2']
+    np.sqrt(f, out=f)
+    np.divide(a, f, out=f)
+
+def uptake_banas(v, W, S, dt, Z, Env):
+    # phytoplankton growth on NO3 only
+    a = W['a']
+    cff3 = W['cff3']
+    NO3 = v['NO3']
+    # K3 = K3min + 2*sqrt(K3min*NO3)
+    np.multiply(NO3, S['K3'], out=a)
+    np.sqrt(a, out=a)
+    a *= 2
+    a += S['K3']
+    # cff3 = dt*mu_max*f*(Phy/(K3 + NO3))
+    a += NO3
+    np.divide(v['Phy'], a, out=cff3)
+    cff3 *= W['f']
+    cff3 *= W['mu_max']
+    cff3 *= dt
+    # NO3 = NO3/(1 + cff3)
+    np.add(cff3, 1, out=a)
+    NO3 /= a
+    # Phy = Phy + cff3*NO3
+    np.multiply(cff3, NO3, out=a)
+    v['Phy'] += a
+
+def uptake(v, W, S, dt, Z, Env):
+    # phytoplankton growth on NO3 and NH4
+    a, b, mu_f = W['a'], W['b'], W['c']
+    cff3, cff4 = W['cff3'], W['cff4']
+    NO3, NH4, Phy = v['NO3'], v['NH4'], v['Phy']
+    K3 = S['K3']
+    K4 = S['K4']
+    # mu_f = dt*mu_max*f
+    np.multiply(W['f'], W['mu_max'], out=mu_f)
+    mu_f *= dt
+    # cff3 = mu_f*(Phy/(K3 + NO3))*(K4/(K4 + NH4))
+    np.add(NH4, K4, out=b)
+    np.divide(K4, b, out=b)
+    np.add(NO3, K3, out=a)
+    np.divide(Phy, a, out=a)
+    np.multiply(a, b, out=cff3)
+    cff3 *= mu_f
+    # cff4 = mu_f*(Phy/(K4 + NH4))
+    np.add(NH4, K4, out=a)
+    np.divide(Phy, a, out=cff4)
+    cff4 *= mu_f
+    # NO3 = NO3/(1 + cff3), NH4 = NH4/(1 + cff4)
+    np.add(cff3, 1, out=a)
+    NO3 /= a
+    np.add(cff4, 1, out=a)
+    NH4 /= a
+    # Phy = Phy + cff3*NO3 + cff4*NH4
+    np.multiply(cff3, NO3, out=a)
+    Phy += a
+    np.multiply(cff4, NH4, out=a)
+    Phy += a
+
+def chl_fixed(v, W, S, dt, Z, Env):
+    # chlorophyll as a fixed ratio to phytoplankton
+    np.multiply(v['Phy'], 2.5, out=v['Chl'])
+
+def chl_fennel(v, W, S, dt, Z, Env):
+    # chlorophyll growth
+    a, b, c = W['a'], W['b'], W['c']
+    NO3, NH4, Phy, Chl = v['NO3'], v['NH4'], v['Phy'], v['Chl']
+    K3 = S['K3']
+    K4 = S['K4']
+    # mu = mu3 + mu4 = mu_max*f*((NO3/(K3 + NO3))*(K4/(K4 + NH4)) + NH4/(K4 + NH4))
+    np.add(NO3, K3, out=a)
+    np.divide(NO3, a, out=a)
+    np.add(NH4, K4, out=b)
+    np.divide(K4, b, out=b)
+    a *= b
+    np.add(NH4, K4, out=b)
+    np.divide(NH4, b, out=b)
+    a += b
+    a *= W['mu_max']
+    a *= W['f']
+    # rho_Chl = PhyCN*C_AtWt*Chl2C_m*mu*Phy/(PhyIS*E*Chl)
+    a *= S['rho_Chl_fac']
+    a *= Phy
+    np.multiply(W['E'], Chl, out=b)
+    a /= b
+    # Chl = Chl + rho_Chl*(Chl/Phy)*(cff3*NO3 + cff4*NH4)
+    np.divide(Chl, Phy, out=b)
+    a *= b
+    np.multiply(W['cff3'], NO3, out=b)
+    np.multiply(W['cff4'], NH4, out=c)
+    b += c
+    a *= b
+    Chl += a
+
+def graze_nb(v, W, S, dt, Z, Env):
+    # grazing by zooplankton, with the unassimilated part split between
+    # SDet and dissolved N (S['graze_to'])
+    cff, b, c = W['a'], W['b'], W['c']
+    Phy = v['Phy']
+    # cff = dt*ZooGR*(Phy*Zoo/(K_Phy + Phy**2))
+    np.multiply(Phy, Phy, out=cff)
+    cff += S['K_Phy']
+    np.multiply(Phy, v['Zoo'], out=b)
+    np.divide(b, cff, out=cff)
+    cff *= S['ZooGR']
+    cff *= dt
+    # Phy = Phy/(1 + cff)
+    np.add(cff, 1, out=b)
+    Phy /= b
+    # then split cff*Phy between Zoo, SDet and dissolved N
+    np.multiply(cff, Phy, out=b)
+    np.multiply(b, S['graze_Zoo'], out=c)
+    v['Zoo'] += c
+    np.multiply(b, S['graze_SDet'], out=c)
+    v['SDet'] += c
+    np.multiply(b, S['graze_N'], out=c)
+    v[S['graze_to']] += c
+
+def graze_fennel(v, W, S, dt, Z, Env):
+    # grazing by zooplankton
+    cff, b, c = W['a'], W['b'], W['c']
+    Phy = v['Phy']
+    # cff = dt*ZooGR*(Phy*Zoo/(K_Phy + Phy**2))
+    np.multiply(Phy, Phy, out=cff)
+    cff += S['K_Phy']
+    np.multiply(Phy, v['Zoo'], out=b)
+    np.divide(b, cff, out=cff)
+    cff *= S['ZooGR']
+    cff *= dt
+    # Phy = Phy/(1 + cff), Chl = Chl/(1 + cff)
+    np.add(cff, 1, out=b)
+    Phy /= b
+    v['Chl'] /= b
+    # then split cff*Phy between Zoo and SDet
+    np.multiply(cff, Phy, out=b)
+    np.multiply(b, S['graze_Zoo'], out=c)
+    v['Zoo'] += c
+    np.multiply(b, S['graze_SDet'], out=c)
+    v['SDet'] += c
+
+def zoo_metabolism(v, W, S, dt, Z, Env):
     # zooplankton metabolism
-    if modname in ['banas', 'mix0']:
-        pass
-    elif modname == 'fennel':
-        Metab = p.ZooBM + p.ZooER * p.ZooAE_N * v['Phy']**2 / (p.K_Phy + v['Phy']**2)
-        cff = dt * Metab
-        v['Zoo'] = v['Zoo'] / (1 + cff)
-        v['NH4'] = v['NH4'] + cff * v['Zoo']
-    
+    cff, b = W['a'], W['b']
+    # cff = dt*(ZooBM + ZooER*ZooAE_N*Phy**2/(K_Phy + Phy**2))
+    np.multiply(v['Phy'], v['Phy'], out=cff)
+    np.add(cff, S['K_Phy'], out=b)
+    cff /= b
+    cff *= S['ZooER_AE']
+    cff += S['ZooBM']
+    cff *= dt
+    # Zoo = Zoo/(1 + cff), NH4 = NH4 + cff*Zoo
+    np.add(cff, 1, out=b)
+    v['Zoo'] /= b
+    np.multiply(cff, v['Zoo'], out=b)
+    v['NH4'] += b
+
+def phy_mortality(v, W, S, dt, Z, Env):
     # phytoplankton mortality
-    if modname in ['banas', 'mix0']:
-        cff = dt * p.PhyMR_nb
-        v['Phy'] = v['Phy'] / (1 + cff)
-        v['SDet'] = v['SDet'] + cff * v['Phy']
-    elif modname == 'fennel':
-        cff = dt * p.PhyMR
-        v['Phy'] = v['Phy'] / (1 + cff)
-        v['Chl'] = v['Chl'] / (1 + cff)
-        v['SDet'] = v['SDet'] + cff * v['Phy']
-    
+    a = W['a']
+    cff = dt * S['PhyMR']
+    v['Phy'] /= (1 + cff)
+    np.multiply(v['Phy'], cff, out=a)
+    v['SDet'] += a
+
+def phy_mortality_chl(v, W, S, dt, Z, Env):
+    # phytoplankton mortality, with Chl following Phy
+    a = W['a']
+    cff = dt * S['PhyMR']
+    v['Phy'] /= (1 + cff)
+    v['Chl'] /= (1 + cff)
+    np.multiply(v['Phy'], cff, out=a)
+    v['SDet'] += a
+
+def zoo_mortality(v, W, S, dt, Z, Env):
     # zooplankton mortality
-    if modname in ['banas', 'mix0']:
-        cff = dt * p.ZooMR_nb * v['Zoo']
-    elif modname == 'fennel':
-        cff = dt * p.ZooMR * v['Zoo']
-    v['Zoo'] = v['Zoo'] / (1 + cff)
-    v['SDet'] = v['SDet'] + cff * v['Zoo']
+    cff, b = W['a'], W['b']
+    # cff = dt*ZooMR*Zoo
+    np.multiply(v['Zoo'], dt * S['ZooMR'], out=cff)
+    # Zoo = Zoo/(1 + cff), SDet = SDet + cff*Zoo
+    np.add(cff, 1, out=b)
+    v['Zoo'] /= b
+    np.multiply(cff, v['Zoo'], out=b)
+    v['SDet'] += b
+
+def coag_nb(v, W, S, dt, Z, Env):
+    # coagulation, just SDet => LDet
+    cffS, b = W['a'], W['b']
+    # cffS = dt*CoagR*Phy*SDet
+    np.multiply(v['Phy'], v['SDet'], out=cffS)
+    cffS *= dt * S['CoagR']
+    # SDet = SDet/(1 + cffS), LDet = LDet + cffS*SDet
+    np.add(cffS, 1, out=b)
+    v['SDet'] /= b
+    np.multiply(cffS, v['SDet'], out=b)
+    v['LDet'] += b
+
+def coag_fennel(v, W, S, dt, Z, Env):
+    # coagulation, SDet + Phy => LDet
+    cffP, b, cffS = W['a'], W['b'], W['c']
+    # Coag = dt*CoagR*(Phy + SDet), cffP = Coag*Phy, cffS = Coag*SDet
+    np.add(v['Phy'], v['SDet'], out=cffS)
+    cffS *= dt * S['CoagR']
+    np.multiply(cffS, v['Phy'], out=cffP)
+    cffS *= v['SDet']
+    # Phy = Phy/(1 + cffP), Chl = Chl/(1 + cffP)
+    np.add(cffP, 1, out=b)
+    v['Phy'] /= b
+    v['Chl'] /= b
+    # SDet = SDet/(1 + cffS)
+    np.add(cffS, 1, out=b)
+    v['SDet'] /= b
+    # LDet = LDet + cffP*Phy + cffS*SDet
+    cffP *= v['Phy']
+    v['LDet'] += cffP
+    cffS *= v['SDet']
+    v['LDet'] += cffS
+
+def remin(v, W, S, dt, Z, Env):
+    # remineralization of detritus to dissolved N (S['remin_to'])
+    a = W['a']
+    vn = S['remin_to']
+    cffS = dt * S['SDeRRN']
+    v['SDet'] /= (1 + cffS)
+    np.multiply(v['SDet'], cffS, out=a)
+    v[vn] += a
+    cffL = dt * S['LDeRRN']
+    v['LDet'] /= (1 + cffL)
+    np.multiply(v['LDet'], cffL, out=a)
+    v[vn] += a
+
+def nitrification(v, W, S, dt, Z, Env):
+    # nitrification, inhibited by light
+    cff, b = W['a'], W['b']
+    # cff = dt*NitriR*(1 - max(0, (E - I_thNH4)/(D_p5NH4 + E - I_thNH4)))
+    np.subtract(W['E'], S['I_thNH4'], out=cff)
+    np.add(cff, S['D_p5NH4'], out=b)
+    cff /= b
+    np.maximum(cff, 0, out=cff)
+    np.subtract(1, cff, out=cff)
+    cff *= dt * S['NitriR']
+    # NH4 = NH4/(1 + cff), NO3 = NO3 + cff*NH4
+    np.add(cff, 1, out=b)
+    v['NH4'] /= b
+    np.multiply(cff, v['NH4'], out=b)
+    v['NO3'] += b
+
+def sink_all(v, W, S, dt, Z):
+    # sinking of all the variables in S['sink_vn'] as one stack, putting the
+    # N flux out the bottom [concentration in the bottom cell] in
+    # W['max_denitrification']
+    if dt not in W['sink_ops']:
+        W['sink_ops'][dt] = get_sink_ops(S['Wsink'], dt, Z['z_w'], shape=W['shape'])
+    Csink = W['Csink']
+    for ii, vn in enumerate(S['sink_vn']):
+        np.copyto(Csink[ii], v[vn])
+    sink_stack_inplace(Csink, W['sink_ops'][dt], W)
+    for ii, vn in enumerate(S['sink_vn']):
+        np.copyto(v[vn], W['Csink_new'][ii])
+    max_denitrification = W['max_denitrification']
+    max_denitrification.fill(0)
+    for ii in range(len(S['sink_vn'])):
+        if S['sink_N'][ii]:
+            max_denitrification += W['sink_flux'][ii]
+    max_denitrification /= S['dz0']
+    return max_denitrification
+
+def sink_nb(v, W, S, dt, Z, Env):
+    # sinking
+    max_denitrification = sink_all(v, W, S, dt, Z)
+    # bottom boundary layer
+    # (i) instant remineralization of all sinking particles
+    v['NO3'][..., 0] += max_denitrification
+    # (ii) some benthic loss
+    denitrification = W['denitrification']
+    np.minimum(max_denitrification, dt*S['chi_nb']/S['dz0'], out=denitrification)
+    v['NO3'][..., 0] -= denitrification
+    np.multiply(denitrification, S['dz0'], out=W['ddenitrified'])
+
+def sink_fennel(v, W, S, dt, Z, Env):
+    # sinking
+    max_denitrification = sink_all(v, W, S, dt, Z)
+    # bottom boundary layer
+    denit_fac = S['denit_fac']
+    np.multiply(max_denitrification, denit_fac, out=W['denitrification'])
+    v['NH4'][..., 0] += W['denitrification']
+    np.multiply(max_denitrification, S['dz0'] * (1 - denit_fac), out=W['ddenitrified'])
+
+def update_v(v, denitrified, modname, dt, Z, Env, S=None, W=None):
+    """
+    Integrate all the NPZD processes forward one time step dt [days].
     
-    # coagulation
-    if modname in ['banas', 'mix0']:
-        Coag = p.CoagR_nb * v['Phy']
-        cffS = dt * Coag * v['SDet']
-        v['SDet'] = v['SDet'] / (1 + cffS)
-        v['LDet'] = v['LDet'] + cffS * v['SDet']
-    elif modname == 'fennel':
-        Coag = p.CoagR * (v['Phy'] + v['SDet'])
-        cffP = dt * Coag * v['Phy']
-        v['Phy'] = v['Phy'] / (1 + cffP)
-        v['Chl'] = v['Chl'] / (1 + cffP)
-        cffS = dt * Coag * v['SDet']
-        v['SDet'] = v['SDet'] / (1 + cffS)
-        v['LDet'] = v['LDet'] + cffP * v['Phy'] + cffS * v['SDet']
-    
-    # remineralization
-    if modname == 'banas':
-        cffS = dt * p.SDeRRN_nb
-        v['SDet'] = v['SDet'] / (1 + cffS)
-        v['NO3'] = v['NO3'] + cffS * v['SDet']
-        cffL = dt * p.LDeRRN_nb
-        v['LDet'] = v['LDet'] / (1 + cffL)
-        v['NO3'] = v['NO3'] + cffL * v['LDet']
-    elif modname == 'fennel':
-        cffS = dt * p.SDeRRN
-        v['SDet'] = v['SDet'] / (1 + cffS)
-        v['NH4'] = v['NH4'] + cffS * v['SDet']
-        cffL = dt * p.LDeRRN
-        v['LDet'] = v['LDet'] / (1 + cffL)
-        v['NH4'] = v['NH4'] + cffL * v['LDet']
-    elif modname == 'mix0':
-        cffS = dt * p.SDeRRN_nb
-        v['SDet'] = v['SDet'] / (1 + cffS)
-        v['NH4'] = v['NH4'] + cffS * v['SDet']
-        cffL = dt * p.LDeRRN_nb
-        v['LDet'] = v['LDet'] / (1 + cffL)
-        v['NH4'] = v['NH4'] + cffL * v['LDet']
+    Each entry of v is either a single profile (N) or an ensemble of columns
+    (ncol, N), with z as the last axis. In the ensemble case every process
+    advances all the columns at once, and denitrified is an array (ncol).
+    Env['temp'] and Env['salt'] may be (N) or (ncol, N).
     
-    # nitrification
-    if modname == 'banas':
-        pass
-    elif modname in ['fennel', 'mix0']:
-        Nitri = p.NitriR * (1 - np.maximum(0*E, ((E - p.I_thNH4) / (p.D_p5NH4 + E - p.I_thNH4))))
-        cff = dt * Nitri
-        v['NH4'] = v['NH4'] / (1 + cff)
-        v['NO3'] = v['NO3'] + cff * v['NH4']
+    The arrays in v are updated in place, so they must be float arrays that
+    do not share memory with each other.
     
-    # sinking
-    max_denitrification = 0
-    if modname in ['banas', 'mix0']:
-        Wsink_dict = {'SDet':p.wSDet_nb, 'LDet':p.wLDet_nb}
-        for vn in Wsink_dict.keys():
-            C = v[vn].copy()
-            Wsink = Wsink_dict[vn]
-            Cnew, max_denitrification = sink(vn, C, max_denitrification, Wsink, dt, Z)
-            v[vn] = Cnew
-        # bottom boundary layer
-        # (i) instant remineralization of all sinking particles
-        v['NO3'][0] += max_denitrification
-        # (ii) some benthic loss
-        chi_nb = 1.2 # loss of nitrate to sediments [mmol NO3 m-2 d-1]
-        denitrification = np.min((dt*chi_nb/Z['Dz'], max_denitrification))
-        v['NO3'][0] -= denitrification
-        denitrified += Z['Dz'] * denitrification
-    elif modname == 'fennel':
-        Wsink_dict = {'Phy':p.wPhy, 'Chl':p.wPhy, 'SDet':p.wSDet, 'LDet':p.wLDet}
-        for vn in Wsink_dict.keys():
-            C = v[vn].copy()
-            Wsink = Wsink_dict[vn]
-            Cnew, max_denitrification = sink(vn, C, max_denitrification, Wsink, dt, Z)
-            v[vn] = Cnew
-        # bottom boundary layer
-        denit_fac = 0.25 # fraction of particle flux at bottom that is returned to NH4, 4/16
-        v['NH4'][0] += denit_fac * max_denitrification
-        denitrified += Z['Dz'] * (1 - denit_fac) * max_denitrification
-        
-    return v, denitrified
\ No newline at end of file
+    S is the compiled spec from get_spec(), and W is the dict of work arrays
+    from get_work(). Pass both in from the time loop to avoid rebuilding them
+    every step, in which case the step allocates no new profile arrays.
+    """
+    if S is None:
+        S = get_spec(modname, Z, Env)
+    if W is None:
+        W = get_work(S, v['Phy'].shape)
+    W['ddenitrified'].fill(0)
+    for fun in S['process_list']:
+        fun(v, W, S, dt, Z, Env)
+    return v, denitrified + W['ddenitrified']
+
+def update_fast(v, W, S, dt, Z, Env, nsub=1):
+    """
+    Subcycle the fast processes (the first S['nfast'] in S['process_list']:
+    light, uptake and grazing) nsub times with time step dt/nsub.
+    """
+    dt_sub = dt/nsub
+    for isub in range(nsub):
+        for fun in S['process_list'][:S['nfast']]:
+            fun(v, W, S, dt_sub, Z, Env)
+
+def update_slow(v, denitrified, W, S, dt, Z, Env):
+    """
+    Take one step dt of the slow processes (mortality, coagulation,
+    remineralization, nitrification, sinking).
+    """
+    W['ddenitrified'].fill(0)
+    for fun in S['process_list'][S['nfast']:]:
+        fun(v, W, S, dt, Z, Env)
+    return v, denitrified + W['ddenitrified']
+
+def update_v_split(v, denitrified, modname, dt, Z, Env, S=None, W=None, nsub=1):
+    """
+    Like update_v() except the fast processes are subcycled nsub times with
+    time step dt/nsub, and then the slow processes take one step of dt.
+    With nsub = 1 this is the same as update_v().
+    """
+    if S is None:
+        S = get_spec(modname, Z, Env)
+    if W is None:
+        W = get_work(S, v['Phy'].shape)
+    update_fast(v, W, S, dt, Z, Env, nsub=nsub)
+    return update_slow(v, denitrified, W, S, dt, Z, Env)
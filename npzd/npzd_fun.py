@@ -0,0 +1,370 @@
+"""
+Functions to set up and run the 1-D NPZD model, used by driver.py and
+sweep.py.
+"""
+
+import numpy as np
+import sys
+import netCDF4 as nc
+import parameters as p
+import npzd_equations
+from importlib import reload
+reload(npzd_equations)
+
+# variables saved as profiles and as reservoirs (vertical integrals)
+vn_list = ['Phy', 'Chl', 'Zoo', 'SDet', 'LDet', 'NO3', 'NH4']
+vnr_list = ['Phy', 'Zoo', 'SDet', 'LDet', 'NO3', 'NH4', 'Lost']
+
+def get_info(override_dict=None):
+    """
+    Default settings for a model run, with any entries replaced by those in
+    override_dict.
+    """
+    info = dict()
+    # the model to use: 'banas', 'fennel', etc.
+    info['modname'] = 'mix0'
+    # number of water columns to run at once as an ensemble
+    info['ncol'] = 1
+    # z-coordinates
+    info['H'] = 30 # max depth [m]
+    info['N'] = 30 # number of vertical grid cells
+    # time
+    info['tmax'] = 20 # max time [days]
+    info['dt'] = 0.01 # time step [days]
+    info['Nsave_p'] = 10 # number of intervals between saves of profiles
+    info['Nsave_r'] = 100 # number of intervals between saves of net amounts
+    info['float32'] = False # write streamed output as float32 to save space
+    # adaptive time stepping: if True, dt is the smallest time step allowed,
+    # and steps of dt*2**k up to dt_max are taken when the local error allows.
+    # For the same accuracy this takes more calls than fixed steps, see
+    # step_adaptive().
+    info['adaptive'] = False
+    info['dt_max'] = 1.28 # largest time step [days], must be dt*2**k
+    info['nsub'] = 1 # number of subcycles of the fast processes per step
+    info['atol'] = 0.01 # largest allowed local error of any tracer per step [mmol N m-3]
+    # intial conditions, all [mmol N m-3], except Chl which is [mg Chl m-3]
+    info['Phy0'] = 0.01
+    info['Chl0'] = 2.5 * info['Phy0']
+    info['Zoo0'] = 0.1 * info['Phy0']
+    info['SDet0'] = 0
+    info['LDet0'] = 0
+    info['NO30'] = 20
+    info['NH40'] = 0
+    # environment
+    info['temp'] = 10 # potential temperature [deg C]
+    info['salt'] = 32 # salinity [psu]
+    info['swrad0'] = 500 # surface downward shortwave radiation [W m-3]
+    if override_dict is not None:
+        for k in override_dict.keys():
+            if k not in info.keys():
+                print('Error: unknown setting ' + k)
+                sys.exit()
+            info[k] = override_dict[k]
+    return info
+
+def split_overrides(override_dict):
+    """
+    Split a dict of overrides into those for get_info() and those for
+    parameters.py (P in npzd_equations.get_spec()).
+    """
+    info_keys = get_info().keys()
+    I = dict()
+    P = dict()
+    for k in override_dict.keys():
+        if k in info_keys:
+            I[k] = override_dict[k]
+        elif hasattr(p, k):
+            P[k] = override_dict[k]
+        else:
+            print('Error: unknown setting or parameter ' + k)
+            sys.exit()
+    return I, P
+
+def get_net_N(v, denitrified, Dz):
+    """
+    Column-integrated N [mmol N m-2], including what has been denitrified,
+    which the model should conserve.
+    """
+    net_N = 0
+    for vn in vn_list:
+        if vn == 'Chl':
+            pass
+        else:
+            net_N += np.sum(Dz * v[vn], axis=-1)
+    net_N += denitrified
+    return net_N
+
+def step_adaptive(v, denitrified, k, k_max, info, S, W, B, Z, Env):
+    """
+    Take one adaptive step, trying dt*2**k first.
+
+    The local error is estimated by step doubling: we take the step once
+    with h = dt*2**k and again as two steps of h/2, starting from the backup
+    copy B['start'], and the error is the largest difference between the two
+    of any tracer. If it is more than info['atol'] we go back to B['start']
+    and try again with half the step. A step of dt (k = 0) is always
+    accepted. We keep the result of the two half steps. Each step uses
+    update_v_split(), with the fast processes subcycled info['nsub'] times.
+
+    The local error of this first-order scheme goes as h**2, so the next
+    step is doubled if the error was less than info['atol']/4.
+
+    Returns the state, the k that was used, the suggested k for the next
+    step, and a dict of counts: calls to update_v_split() (ncalls),
+    fast-process subcycles (nfast), and rejected tries (nreject).
+    """
+    dt = info['dt']
+    nsub = info['nsub']
+    y0 = B['start']
+    y1 = B['full']
+    for vn in vn_list:
+        np.copyto(y0[vn], v[vn])
+    cnt = {'ncalls':0, 'nfast':0, 'nreject':0}
+    while True:
+        h = dt * 2**k
+        # one step of h, saved in y1
+        v, _ = npzd_equations.update_v_split(v, denitrified, None, h, Z, Env,
+            S=S, W=W, nsub=nsub)
+        for vn in vn_list:
+            np.copyto(y1[vn], v[vn])
+            np.copyto(v[vn], y0[vn])
+        # two steps of h/2
+        v, denitrified_new = npzd_equations.update_v_split(v, denitrified, None, h/2,
+            Z, Env, S=S, W=W, nsub=nsub)
+        v, denitrified_new = npzd_equations.update_v_split(v, denitrified_new, None, h/2,
+            Z, Env, S=S, W=W, nsub=nsub)
+        cnt['ncalls'] += 3
+        cnt['nfast'] += 3 * nsub
+        # largest difference of any tracer, using W['a']
+        err = 0
+        for vn in vn_list:
+            np.subtract(v[vn], y1[vn], out=W['a'])
+            np.abs(W['a'], out=W['a'])
+            err = max(err, W['a'].max())
+        if (err <= info['atol']) or (k == 0):
+            break
+        # reject the step
+        cnt['nreject'] += 1
+        for vn in vn_list:
+            np.copyto(v[vn], y0[vn])
+        k -= 1
+    if err < info['atol']/4:
+        k_next = min(k + 1, k_max)
+    else:
+        k_next = k
+    return v, denitrified_new, k, k_next, cnt
+
+def start_output(out_fn, info, z_rho):
+    """
+    Create a NetCDF file for streaming output from run(). The profiles and
+    reservoirs each get their own unlimited time dimension (tp and tr) so
+    they can be appended as the run proceeds, and are chunked by one save
+    in time.
+    """
+    ncol = info['ncol']
+    N = info['N']
+    if info['float32']:
+        vtype = 'f4'
+    else:
+        vtype = 'f8'
+    ds = nc.Dataset(out_fn, 'w')
+    ds.createDimension('tp', None)
+    ds.createDimension('tr', None)
+    ds.createDimension('col', ncol)
+    ds.createDimension('z', N)
+    vv = ds.createVariable('tp', float, ('tp',))
+    vv.units = 'days'
+    vv = ds.createVariable('tr', float, ('tr',))
+    vv.units = 'days'
+    vv = ds.createVariable('z', float, ('z',))
+    vv.units = 'm'
+    vv[:] = z_rho
+    for vn in vn_list:
+        ds.createVariable(vn, vtype, ('tp', 'col', 'z'), chunksizes=(1, ncol, N))
+    for vn in vnr_list:
+        ds.createVariable('R_' + vn, vtype, ('tr', 'col'), chunksizes=(1, ncol))
+    ds.createVariable('cons_err', float, ('tp', 'col'))
+    for k in info.keys():
+        ds.setncattr(k, str(info[k]))
+    return ds
+
+def run(info, P=None, verbose=False, out_fn=None):
+    """
+    Run the model using the settings in info, and the parameter overrides
+    in P (if any).
+
+    The outputs are packed (time, ncol, N) for profiles in V, and
+    (time, ncol) for reservoirs in R. The column-integrated N (including
+    what has been denitrified) should not change, so cons_err is the
+    largest change of its depth-mean [mmol N m-3] over the saved profiles.
+
+    If out_fn is given the profiles and reservoirs are instead appended to
+    that NetCDF file at each save (see start_output()), which is synced at
+    each profile save so it can be read while the run is going and survives
+    a crash. The save cadence is set by info['Nsave_p'] and info['Nsave_r']. In this case
+    they are not kept in memory, and V and R in the output are None.
+
+    If info['adaptive'] is True the time step varies between info['dt']
+    and info['dt_max'], set by step_adaptive(). Steps are chosen so they land
+    on every save time. The output has the number of calls to update_v() or
+    update_v_split() (including those in rejected tries) as ncalls, the
+    number of fast-process subcycles as nfast (the same as ncalls for fixed
+    steps or nsub = 1), and the number of rejected tries as nreject.
+    """
+    modname = info['modname']
+    ncol = info['ncol']
+    H = info['H']
+    N = info['N']
+    dt = info['dt']
+    tmax = info['tmax']
+    if info['adaptive']:
+        k_max = int(np.round(np.log2(info['dt_max']/dt)))
+        if (k_max < 0) or not np.isclose(info['dt_max'], dt * 2**k_max):
+            print('Error: dt_max must be dt*2**k')
+            sys.exit()
+
+    # z-coordinates (bottom to top, positive up)
+    Dz = H/N
+    z_w = np.linspace(-H, 0, N+1)
+    z_rho = z_w[:-1] + Dz/2
+    Z = {'Dz': Dz, 'N': N, 'z_rho': z_rho, 'z_w': z_w}
+
+    # number of time steps
+    nt = int(np.round(tmax/dt))
+    # number of time steps between saves of profiles
+    ntp = int(np.round((tmax/info['Nsave_p'])/dt))
+    Ntp = int(np.round((nt/ntp))) + 1 # total number of saved profiles
+    # number of time steps between saves of net amounts (reservoirs)
+    ntr = int(np.round((tmax/info['Nsave_r'])/dt))
+    Ntr = int(np.round((nt/ntr))) + 1 # total number of saved net amounts
+
+    # initialize dict of output arrays, or the output file
+    if out_fn is None:
+        V = dict()
+        for vn in vn_list:
+            V[vn] = np.nan * np.ones((Ntp, ncol, N))
+        R = dict()
+        for vn in vnr_list:
+            R[vn] = np.nan * np.ones((Ntr, ncol))
+    else:
+        V = None
+        R = None
+        ds = start_output(out_fn, info, z_rho)
+
+    # intial conditions, packed as (ncol, N) with z as the last axis
+    v = dict()
+    for vn in vn_list:
+        v[vn] = info[vn + '0'] * np.ones((ncol, N))
+
+    # temp and salt may be given as scalars, profiles (N), or (ncol, N),
+    # and swrad0 as a scalar or one value per column
+    temp = info['temp'] * np.ones(N)
+    salt = info['salt'] * np.ones(N)
+    swrad0 = info['swrad0'] * np.ones((ncol, 1))
+    Env = {'temp': temp, 'salt': salt, 'swrad0': swrad0}
+
+    denitrified = np.zeros(ncol)
+
+    # compile the model specification (constants and process list) once,
+    # and allocate the work arrays used by update_v()
+    S = npzd_equations.get_spec(modname, Z, Env, P=P)
+    W = npzd_equations.get_work(S, v['Phy'].shape)
+
+    if info['adaptive']:
+        # backup copy of the state for rejected steps, and the result of
+        # one full step for the error estimate
+        B = {'start':dict(), 'full':dict()}
+        for vn in vn_list:
+            B['start'][vn] = np.zeros((ncol, N))
+            B['full'][vn] = np.zeros((ncol, N))
+        k = 0
+
+    TPvec = []
+    TRvec = []
+    net_N0 = None
+    cons_err = np.zeros(ncol)
+    cnt = {'ncalls':0, 'nfast':0, 'nreject':0}
+    # it counts time in units of dt
+    it = 0
+    Itp = 0
+    Itr = 0
+    while it <= nt:
+
+        # save output vectors if it is time
+        if np.mod(it, ntp) == 0:
+            TPvec.append(it*dt)
+            if out_fn is None:
+                for vn in vn_list:
+                    V[vn][Itp,:,:] = v[vn]
+            else:
+                ds['tp'][Itp] = it*dt
+                for vn in vn_list:
+                    ds[vn][Itp,:,:] = v[vn]
+            # check global conservation
+            net_N = get_net_N(v, denitrified, Dz)
+            if net_N0 is None:
+                net_N0 = net_N.copy()
+            cons_err = np.maximum(cons_err, np.abs(net_N - net_N0)/H)
+            if out_fn is not None:
+                ds['cons_err'][Itp,:] = np.abs(net_N - net_N0)/H
+                ds.sync()
+            if verbose:
+                print('t = %0.2f days' % (it*dt))
+                print(' mean N = %0.7f to %0.7f [mmol N m-3]' % (net_N.min()/H, net_N.max()/H))
+            Itp += 1
+        # save reservoir output if it is time
+        if np.mod(it, ntr) == 0:
+            TRvec.append(it*dt)
+            RR = dict()
+            for vn in vnr_list:
+                if vn == 'Lost':
+                    RR[vn] = denitrified
+                else:
+                    RR[vn] = np.sum(Dz * v[vn], axis=-1)
+            if out_fn is None:
+                for vn in vnr_list:
+                    R[vn][Itr,:] = RR[vn]
+            else:
+                ds['tr'][Itr] = it*dt
+                for vn in vnr_list:
+                    ds['R_' + vn][Itr,:] = RR[vn]
+            Itr += 1
+        if it == nt:
+            break
+
+        # integrate forward one time step
+        if info['adaptive']:
+            # limit the step so it stays aligned and does not pass a save time
+            it_next = min(ntp * (it//ntp + 1), ntr * (it//ntr + 1), nt)
+            k_try = k
+            while (np.mod(it, 2**k_try) != 0) or (it + 2**k_try > it_next):
+                k_try -= 1
+            v, denitrified, k_used, k, c = step_adaptive(v, denitrified, k_try, k_max,
+                info, S, W, B, Z, Env)
+            for kk in cnt.keys():
+                cnt[kk] += c[kk]
+            it += 2**k_used
+        else:
+            v, denitrified = npzd_equations.update_v(v, denitrified, modname, dt, Z, Env, S=S, W=W)
+            cnt['ncalls'] += 1
+            cnt['nfast'] += 1
+            it += 1
+
+    if out_fn is not None:
+        ds.close()
+
+    out = {'V': V, 'R': R, 'TPvec': np.array(TPvec), 'TRvec': np.array(TRvec),
+        'z_rho': z_rho, 'cons_err': cons_err}
+    out.update(cnt)
+    return out
+
+def run_one(task):
+    """
+    Run one experiment of a sweep. task is a tuple (ii, override_dict),
+    and we return (ii, out), so this can be used with Pool.imap_unordered().
+    """
+    ii, override_dict = task
+    I, P = split_overrides(override_dict)
+    info = get_info(I)
+    out = run(info, P=P)
+    return ii, out
@@ -0,0 +1,97 @@
+"""
+Run a sweep of 1-D NPZD experiments across a process pool, and save all the
+results in one NetCDF file indexed by run number.
+
+Edit sweep_dict below to choose the sweep. Each key is either a setting from
+npzd_fun.get_info() (e.g. 'modname', 'dt', 'swrad0') or a parameter from
+parameters.py (e.g. 'ZooGR_nb'), and the sweep is over all combinations of
+the listed values. The settings that change the shape of the output ('H',
+'N', 'tmax', 'Nsave_p', 'Nsave_r', 'ncol') must be the same for all runs, so
+they can only go in base_dict.
+
+Run from this directory, e.g.
+python sweep.py > sweep.log &
+
+The output is a Dataset with variables V_[vn] (run, tp, col, z),
+R_[vn] (run, tr, col), and cons_err (run, col), with the swept values stored
+as coordinates along run.
+"""
+
+import numpy as np
+import xarray as xr
+import itertools
+import sys
+from time import time
+from multiprocessing import Pool
+from lo_tools import Lfun
+import npzd_fun
+from importlib import reload
+reload(npzd_fun)
+
+# ======================================================================
+
+# Choices
+sweep_dict = {
+    'modname': ['banas', 'mix0', 'fennel'],
+    'swrad0': [100, 300, 500],
+    'ZooGR_nb': [2.4, 4.8, 9.6],
+    }
+# settings that are the same for all runs
+base_dict = {'tmax': 20, 'dt': 0.01}
+Nproc = 8 # number of processes in the pool
+out_name = 'sweep_0.nc'
+
+# ----------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+    Ldir = Lfun.Lstart()
+    out_dir = Ldir['parent'] / 'LPM_output' / 'npzd'
+    Lfun.make_dir(out_dir)
+    out_fn = out_dir / out_name
+
+    # make the list of tasks, one per combination of swept values
+    key_list = list(sweep_dict.keys())
+    for k in ['H', 'N', 'tmax', 'Nsave_p', 'Nsave_r', 'ncol']:
+        if k in key_list:
+            print('Error: ' + k + ' cannot be swept, put it in base_dict')
+            sys.exit()
+    task_list = []
+    for ii, val_tup in enumerate(itertools.product(*[sweep_dict[k] for k in key_list])):
+        override_dict = base_dict.copy()
+        override_dict.update(dict(zip(key_list, val_tup)))
+        # check the keys before sending them off to the pool
+        npzd_fun.split_overrides(override_dict)
+        task_list.append((ii, override_dict))
+    NR = len(task_list)
+    print('Total number of runs = %d' % (NR))
+
+    tt0 = time()
+    out_dict = dict()
+    with Pool(Nproc) as pool:
+        for ii, out in pool.imap_unordered(npzd_fun.run_one, task_list):
+            out_dict[ii] = out
+            if (np.mod(len(out_dict),10) == 0) or (len(out_dict) == NR):
+                print(' %d runs done, %0.1f sec' % (len(out_dict), time()-tt0))
+                sys.stdout.flush()
+
+    # pack the results into one Dataset
+    out = out_dict[0]
+    coords = {'run': np.arange(NR), 'tp': out['TPvec'], 'tr': out['TRvec'],
+        'z': out['z_rho']}
+    for k in key_list:
+        coords[k] = ('run', [task_list[ii][1][k] for ii in range(NR)])
+    data_vars = dict()
+    for vn in npzd_fun.vn_list:
+        data_vars['V_' + vn] = (('run', 'tp', 'col', 'z'),
+            np.stack([out_dict[ii]['V'][vn] for ii in range(NR)]))
+    for vn in npzd_fun.vnr_list:
+        data_vars['R_' + vn] = (('run', 'tr', 'col'),
+            np.stack([out_dict[ii]['R'][vn] for ii in range(NR)]))
+    data_vars['cons_err'] = (('run', 'col'),
+        np.stack([out_dict[ii]['cons_err'] for ii in range(NR)]))
+    ds = xr.Dataset(data_vars=data_vars, coords=coords)
+    ds.attrs['base_dict'] = str(base_dict)
+    ds.to_netcdf(out_fn)
+    print('Saved results to ' + str(out_fn))
+    print('Total processing time = %0.2f sec' % (time()-tt0))
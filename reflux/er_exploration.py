@@ -23,8 +23,8 @@ Q_efflux, Q_reflux, W_efflux, W_reflux, Net_efflux, Net_reflux = er2_tup
 Q_efflux_alt, Q_reflux_alt, W_efflux_alt, W_reflux_alt, Net_efflux_alt, Net_reflux_alt = er3_tup
 dt, T_flush = t_tup
 
-# Run for a specified number of flushing times
-nt = 10 * int(T_flush / dt)
+# All the fields plotted below are the steady state, found directly with
+# er_fun.get_steady() rather than running box_model() for 10 flushing times.
 
 # Form an average for scaling of sinking
 W_er = (W_efflux_alt.mean() + W_reflux_alt.mean())/2
@@ -39,19 +39,13 @@ ax = fig.add_subplot(311)
 # Ocean source
 C_river = np.zeros(1)
 C_ocean = np.ones(1)
-C_top = np.zeros(N_boxes)
-C_bot = np.zeros(N_boxes)
-for ii in range (nt):
-    C_bot, C_top = er_fun.box_model(C_bot, C_top, C_river, C_ocean, alpha_efflux, alpha_reflux, V_top, V_bot, dt, Qin, Qout)
+C_bot, C_top = er_fun.get_steady(C_river, C_ocean, alpha_efflux, alpha_reflux, V_top, V_bot, Qin, Qout)
 ax.plot(XB, C_bot, '-r', label='$C_{bot}$ ocean source')
 ax.plot(XB, C_top, '-b', label='$C_{top}$ ocean source')
 # River source
 C_river = np.ones(1)
 C_ocean = np.zeros(1)
-C_top = np.zeros(N_boxes)
-C_bot = np.zeros(N_boxes)
-for ii in range (nt):
-    C_bot, C_top = er_fun.box_model(C_bot, C_top, C_river, C_ocean, alpha_efflux, alpha_reflux, V_top, V_bot, dt, Qin, Qout)
+C_bot, C_top = er_fun.get_steady(C_river, C_ocean, alpha_efflux, alpha_reflux, V_top, V_bot, Qin, Qout)
 ax.plot(XB, C_bot, '--r', label='$C_{bot}$ river source')
 ax.plot(XB, C_top, '--b', label='$C_{top}$ river source')
 ax.set_xlim(0, X[-1])
@@ -63,19 +57,13 @@ ax = fig.add_subplot(312)
 # Ocean source
 C_river = np.zeros(1)
 C_ocean = np.ones(1)
-C_top = np.zeros(N_boxes)
-C_bot = np.zeros(N_boxes)
-for ii in range (nt):
-    C_bot, C_top = er_fun.box_model(C_bot, C_top, C_river, C_ocean, alpha_efflux, alpha_reflux, V_top, V_bot, dt, Qin, Qout, Q_sink=Q_sink)
+C_bot, C_top = er_fun.get_steady(C_river, C_ocean, alpha_efflux, alpha_reflux, V_top, V_bot, Qin, Qout, Q_sink=Q_sink)
 ax.plot(XB, C_bot, '-r', label='$C_{bot}$ ocean source')
 ax.plot(XB, C_top, '-b', label='$C_{top}$ ocean source')
 # River source
 C_river = np.ones(1)
 C_ocean = np.zeros(1)
-C_top = np.zeros(N_boxes)
-C_bot = np.zeros(N_boxes)
-for ii in range (nt):
-    C_bot, C_top = er_fun.box_model(C_bot, C_top, C_river, C_ocean, alpha_efflux, alpha_reflux, V_top, V_bot, dt, Qin, Qout, Q_sink=Q_sink)
+C_bot, C_top = er_fun.get_steady(C_river, C_ocean, alpha_efflux, alpha_reflux, V_top, V_bot, Qin, Qout, Q_sink=Q_sink)
 ax.plot(XB, C_bot, '--r', label='$C_{bot}$ river source')
 ax.plot(XB, C_top, '--b', label='$C_{top}$ river source')
 ax.set_xlim(0, X[-1])
@@ -88,19 +76,13 @@ ax = fig.add_subplot(313)
 # Ocean source
 C_river = np.zeros(1)
 C_ocean = np.ones(1)
-C_top = np.zeros(N_boxes)
-C_bot = np.zeros(N_boxes)
-for ii in range (nt):
-    C_bot, C_top = er_fun.box_model(C_bot, C_top, C_river, C_ocean, alpha_efflux, alpha_reflux, V_top, V_bot, dt, Qin, Qout, T_decay_inv=1/T_flush)
+C_bot, C_top = er_fun.get_steady(C_river, C_ocean, alpha_efflux, alpha_reflux, V_top, V_bot, Qin, Qout, T_decay_inv=1/T_flush)
 ax.plot(XB, C_bot, '-r', label='$C_{bot}$ ocean source')
 ax.plot(XB, C_top, '-b', label='$C_{top}$ ocean source')
 # River source
 C_river = np.ones(1)
 C_ocean = np.zeros(1)
-C_top = np.zeros(N_boxes)
-C_bot = np.zeros(N_boxes)
-for ii in range (nt):
-    C_bot, C_top = er_fun.box_model(C_bot, C_top, C_river, C_ocean, alpha_efflux, alpha_reflux, V_top, V_bot, dt, Qin, Qout, T_decay_inv=1/T_flush)
+C_bot, C_top = er_fun.get_steady(C_river, C_ocean, alpha_efflux, alpha_reflux, V_top, V_bot, Qin, Qout, T_decay_inv=1/T_flush)
 ax.plot(XB, C_bot, '--r', label='$C_{bot}$ river source')
 ax.plot(XB, C_top, '--b', label='$C_{top}$ river source')
 ax.set_xlim(0, X[-1])
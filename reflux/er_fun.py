@@ -3,13 +3,38 @@ Efflux-Reflux utility functions
 """
 
 import numpy as np
+import pandas as pd
 import sys
+from scipy import sparse
+from scipy.sparse import linalg as spla
+import npzd_equations as npzde
+
+# memoized physical solutions, keyed by the arguments of get_params()
+params_cache = dict()
 
 def get_params(Qr=1e3, B=3e3, H_top=20, H_bot=20, Sbar_0=30, DS_0=5,
     N_boxes=100, L=50e3, etype='chatwin'):
     """
     This is the primary function for getting all the variables used for a box
     model time integration.
+
+    The solution for each set of arguments is only made once per process and
+    then reused from params_cache. The arrays are set to read-only so that
+    one script cannot change them for the next.
+    """
+    key = (Qr, B, H_top, H_bot, Sbar_0, DS_0, N_boxes, L, etype)
+    if key not in params_cache:
+        out = make_params(*key)
+        for tup in out:
+            for item in tup:
+                if isinstance(item, np.ndarray):
+                    item.setflags(write=False)
+        params_cache[key] = out
+    return params_cache[key]
+
+def make_params(Qr, B, H_top, H_bot, Sbar_0, DS_0, N_boxes, L, etype):
+    """
+    Make the physical solution for get_params().
     """
 
     # Estuary physical parameters
@@ -28,6 +53,9 @@ def get_params(Qr=1e3, B=3e3, H_top=20, H_bot=20, Sbar_0=30, DS_0=5,
         Sin, Sout, x, L = get_Sio_chatwin(Sbar_0, DS_0, N_boxes, L)
     elif etype == 'hr':
         Sin, Sout, x, L = get_Sio_hr(Sbar_0, DS_0, N_boxes, L)
+    else:
+        print('Error: unknown etype ' + str(etype))
+        sys.exit()
 
     DS = Sin - Sout
 
@@ -153,17 +181,22 @@ def alpha_calc(Qin, Qout, Sin, Sout):
 def box_model(C_bot, C_top, C_river, C_ocean, alpha_efflux, alpha_reflux, V_top, V_bot, dt, Qin, Qout, Q_sink=0, T_decay_inv=0):
     """
     Box model integrator, for a single time 
+
+    C_bot and C_top may also be (ntracer, N_boxes) stacks, with C_river and
+    C_ocean (ntracer, 1), Q_sink (ntracer, N_boxes) or (ntracer, 1), and
+    T_decay_inv (ntracer, 1), so that all the tracers are advanced together.
     """
     # check that the sinking is not too fast
     if dt*np.max(Q_sink) >= np.min(V_top):
         print('Error: sinking will lose more than upper layer volume!')
         sys.exit()
-    top_upstream = np.concatenate((C_river, C_top[:-1]))
-    bot_upstream = np.concatenate((C_bot[1:], C_ocean))
+    NT = C_top.shape[:-1] + (1,)
+    top_upstream = np.concatenate((np.broadcast_to(C_river, NT), C_top[..., :-1]), axis=-1)
+    bot_upstream = np.concatenate((C_bot[..., 1:], np.broadcast_to(C_ocean, NT)), axis=-1)
     sink = C_top*Q_sink
     # force sink = 0 in the first box because the bottom cell there is
     # not active
-    sink[0] = 0
+    sink[..., 0] = 0
     C_top = C_top + (dt/V_top)*((1 - alpha_reflux)*top_upstream*Qout[:-1]
         + alpha_efflux*bot_upstream*Qin[1:]
         - C_top*Qout[1:]
@@ -172,6 +205,490 @@ def box_model(C_bot, C_top, C_river, C_ocean, alpha_efflux, alpha_reflux, V_top,
         + alpha_reflux*top_upstream*Qout[:-1]
         - C_bot*Qin[:-1]
         + sink) - dt*C_bot*T_decay_inv
-    C_bot[0] = np.nan # first bottom cell not active, so mask
+    C_bot[..., 0] = np.nan # first bottom cell not active, so mask
     
-    return C_bot, C_top
\ No newline at end of file
+    return C_bot, C_top
+
+def get_A(alpha_efflux, alpha_reflux, V_top, V_bot, Qin, Qout, Q_sink=0, T_decay_inv=0):
+    """
+    Build the linear operator of box_model() as a sparse matrix, so that
+    the tracer equations are dC/dt = A @ C + b_river*C_river + b_ocean*C_ocean.
+
+    The state vector is C = [C_top, C_bot[1:]], length 2*N_boxes - 1,
+    because the first bottom cell is not active. The terms are exactly the
+    upwind fluxes, sinking, and decay used in box_model(), so both give the
+    same answer in the limit of small dt.
+
+    Returns A [s-1] as a csc matrix, and b_river, b_ocean [s-1], which are
+    the rates at which each box feels a unit boundary value.
+    """
+    N = len(V_top)
+    ae = alpha_efflux
+    ar = alpha_reflux
+    qs = np.zeros(N) + Q_sink
+    qs[0] = 0 # no sinking out of the first box, as in box_model()
+    td = np.zeros(N) + T_decay_inv
+    it = np.arange(N) # index of C_top[i] in the state vector
+    ib = np.concatenate(([-1], N + np.arange(N-1))) # index of C_bot[i]
+    row = []
+    col = []
+    val = []
+    # top layer
+    row += [it, it[1:], it[:-1]]
+    col += [it, it[:-1], ib[1:]]
+    val += [-(Qout[1:] + qs)/V_top - td,
+        (1 - ar[1:])*Qout[1:-1]/V_top[1:],
+        ae[:-1]*Qin[1:-1]/V_top[:-1]]
+    # bottom layer
+    row += [ib[1:], ib[1:-1], ib[1:], ib[1:]]
+    col += [ib[1:], ib[2:], it[:-1], it[1:]]
+    val += [-Qin[1:-1]/V_bot[1:] - td[1:],
+        (1 - ae[1:-1])*Qin[2:-1]/V_bot[1:-1],
+        ar[1:]*Qout[1:-1]/V_bot[1:],
+        qs[1:]/V_bot[1:]]
+    NN = 2*N - 1
+    A = sparse.csc_matrix((np.concatenate(val),
+        (np.concatenate(row), np.concatenate(col))), shape=(NN, NN))
+    b_river = np.zeros(NN)
+    b_river[0] = (1 - ar[0])*Qout[0]/V_top[0]
+    b_ocean = np.zeros(NN)
+    b_ocean[N-1] = ae[-1]*Qin[-1]/V_top[-1]
+    b_ocean[-1] = (1 - ae[-1])*Qin[-1]/V_bot[-1]
+    return A, b_river, b_ocean
+
+def get_solver(alpha_efflux, alpha_reflux, V_top, V_bot, dt, Qin, Qout,
+    Q_sink=0, T_decay_inv=0, theta=1):
+    """
+    Factor the implicit time step for box_model_implicit(), once for a given
+    physical solution, dt, sinking and decay. The result can be reused for
+    every time step and every tracer that shares Q_sink and T_decay_inv.
+
+    theta = 1 is backward Euler, which is unconditionally stable and
+    positive, so dt is not limited by the CFL condition used in get_params().
+    theta = 0.5 is Crank-Nicolson, which is more accurate but can give
+    small oscillations when dt is many times the box flushing time.
+    """
+    if (theta < 0.5) or (theta > 1):
+        print('Error: theta must be between 0.5 and 1')
+        sys.exit()
+    A, b_river, b_ocean = get_A(alpha_efflux, alpha_reflux, V_top, V_bot,
+        Qin, Qout, Q_sink=Q_sink, T_decay_inv=T_decay_inv)
+    I = sparse.identity(A.shape[0], format='csc')
+    solver = dict()
+    solver['lu'] = spla.splu(I - theta*dt*A)
+    solver['R'] = (I + (1 - theta)*dt*A).tocsr()
+    solver['b_river'] = dt*b_river
+    solver['b_ocean'] = dt*b_ocean
+    solver['N'] = len(V_top)
+    solver['dt'] = dt
+    solver['theta'] = theta
+    return solver
+
+def box_model_implicit(C_bot, C_top, C_river, C_ocean, solver):
+    """
+    Implicit version of box_model(), for a single time step, using a solver
+    from get_solver(). The boundary values are held fixed over the step.
+
+    C_bot and C_top may be (N_boxes,) arrays, or (ntracer, N_boxes) stacks
+    with C_river and C_ocean of shape (ntracer, 1), in which case all the
+    tracers are advanced with one solve.
+    """
+    C = pack_C(C_top, C_bot)
+    rhs = (solver['R'] @ C.T).T
+    rhs += solver['b_river']*np.atleast_1d(C_river)[..., :1]
+    rhs += solver['b_ocean']*np.atleast_1d(C_ocean)[..., :1]
+    C = solver['lu'].solve(np.ascontiguousarray(rhs.T)).T
+    return unpack_C(C, solver['N'])
+
+def pack_C(C_top, C_bot):
+    """
+    Form the state vector [C_top, C_bot[1:]] used by get_A(), along the
+    last axis.
+    """
+    return np.concatenate((C_top, C_bot[..., 1:]), axis=-1)
+
+def unpack_C(C, N):
+    """
+    Inverse of pack_C(), returning C_bot, C_top with the inactive first
+    bottom cell masked as nan.
+    """
+    C_top = C[..., :N].copy()
+    C_bot = np.concatenate((np.nan*C[..., :1], C[..., N:]), axis=-1)
+    return C_bot, C_top
+
+def get_steady(C_river, C_ocean, alpha_efflux, alpha_reflux, V_top, V_bot, Qin, Qout,
+    Q_sink=0, T_decay_inv=0, S_top=0, S_bot=0):
+    """
+    Solve directly for the steady state of box_model(), instead of
+    integrating for many flushing times. This is the single sparse solve of
+
+        0 = A @ C + b_river*C_river + b_ocean*C_ocean + S
+
+    where S is a constant source, S_top and S_bot [C s-1], in each layer,
+    and the linear sinks are in A through Q_sink and T_decay_inv.
+
+    C_river and C_ocean may have shape (ntracer, 1), with S_top and S_bot
+    broadcasting to (ntracer, N_boxes), to solve several tracers that share
+    Q_sink and T_decay_inv with one factorization.
+    """
+    N = len(V_top)
+    A, b_river, b_ocean = get_A(alpha_efflux, alpha_reflux, V_top, V_bot,
+        Qin, Qout, Q_sink=Q_sink, T_decay_inv=T_decay_inv)
+    C_river = np.atleast_1d(C_river)[..., :1]
+    C_ocean = np.atleast_1d(C_ocean)[..., :1]
+    S = pack_C(np.zeros(N) + S_top, np.zeros(N) + S_bot)
+    rhs = -(b_river*C_river + b_ocean*C_ocean + S)
+    C = spla.splu(A).solve(np.ascontiguousarray(rhs.T)).T
+    return unpack_C(C, N)
+
+def steady_newton(C_top, C_bot, C_river, C_ocean, A_list, b_river_list, b_ocean_list,
+    rate_fun, dtau=np.inf, tol=1e-8, max_iter=100, verbose=False):
+    """
+    Solve for the steady state of ntracer tracers that are each carried by the
+    box model and coupled by local (within-box) reactions, e.g. NPZD:
+
+        0 = A_k @ C_k + b_river_k*C_river_k + b_ocean_k*C_ocean_k + R_k(C)
+
+    C_top, C_bot: (ntracer, N_boxes) initial guess
+    C_river, C_ocean: (ntracer, 1) boundary values
+    A_list, b_river_list, b_ocean_list: from get_A() for each tracer, so
+        each may have its own Q_sink and T_decay_inv
+    rate_fun(C_top, C_bot) returns R_top, R_bot [C s-1], (ntracer, N_boxes)
+    dtau [s] is the initial pseudo time step. The default np.inf is pure
+        Newton. A finite dtau (e.g. T_flush) gives pseudo-transient
+        continuation, which is much more robust from a poor first guess,
+        and dtau grows as the residual falls so it ends as Newton.
+
+    Because the reactions are local, the reaction part of the Jacobian is
+    found with one extra call to rate_fun() per tracer.
+
+    Returns C_bot, C_top, and a dict with the number of iterations and the
+    final residual norm. Concentrations are kept non-negative. Note that the
+    steady state found may be unstable, e.g. when the time-dependent
+    model has predator-prey oscillations.
+    """
+    ntr = len(A_list)
+    N = C_top.shape[-1]
+    NN = 2*N - 1
+    A_big = sparse.block_diag(A_list, format='csr')
+    b = np.concatenate([b_river_list[k]*C_river[k][0] + b_ocean_list[k]*C_ocean[k][0]
+        for k in range(ntr)])
+    mm = np.arange(NN)
+
+    def get_R(C):
+        C_bot, C_top = unpack_C(C.reshape(ntr, NN), N)
+        C_bot[:, 0] = C_bot[:, 1] # keep the inactive cell finite
+        R_top, R_bot = rate_fun(C_top, C_bot)
+        return pack_C(R_top, R_bot).ravel()
+
+    def get_F(C):
+        R = get_R(C)
+        return A_big @ C + b + R, R
+
+    C = np.maximum(pack_C(C_top, C_bot).ravel(), 0)
+    F, R = get_F(C)
+    Fnorm = np.linalg.norm(F)
+    for it in range(max_iter):
+        # Jacobian of the reactions, perturbing one tracer in all boxes at once
+        row = []
+        col = []
+        val = []
+        for jj in range(ntr):
+            h = 1e-6 * np.maximum(np.abs(C[jj*NN:(jj+1)*NN]), 1e-3)
+            Cp = C.copy()
+            Cp[jj*NN:(jj+1)*NN] += h
+            dR = ((get_R(Cp) - R).reshape(ntr, NN)) / h
+            for kk in range(ntr):
+                row.append(kk*NN + mm)
+                col.append(jj*NN + mm)
+                val.append(dR[kk])
+        J = A_big + sparse.csr_matrix((np.concatenate(val),
+            (np.concatenate(row), np.concatenate(col))), shape=A_big.shape)
+        M = -J
+        if np.isfinite(dtau):
+            M = M + sparse.identity(ntr*NN)/dtau
+        dC = spla.spsolve(M.tocsc(), F)
+        if np.isfinite(dtau):
+            # pseudo-transient continuation: take the full step, but retry
+            # with a shorter dtau if it fails badly
+            lam = 1
+            C_new = np.maximum(C + dC, 0)
+            F_new, R_new = get_F(C_new)
+            Fnorm_new = np.linalg.norm(F_new)
+            if not (Fnorm_new < 10*Fnorm):
+                dtau = dtau/4
+                continue
+            dtau = dtau * Fnorm / Fnorm_new
+        else:
+            # Newton: backtrack if the full step makes the residual worse
+            lam = 1
+            while True:
+                C_new = np.maximum(C + lam*dC, 0)
+                F_new, R_new = get_F(C_new)
+                Fnorm_new = np.linalg.norm(F_new)
+                if (Fnorm_new < Fnorm) or (lam < 1/64):
+                    break
+                lam = lam/2
+        dC_max = np.max(np.abs(C_new - C))
+        C, F, R, Fnorm = C_new, F_new, R_new, Fnorm_new
+        if verbose:
+            print(' it = %d, residual = %0.2e, max change = %0.2e, lam = %0.3f'
+                % (it, Fnorm, dC_max, lam))
+        if dC_max <= tol * np.max(np.abs(C)):
+            break
+    C_bot, C_top = unpack_C(C.reshape(ntr, NN), N)
+    return C_bot, C_top, {'n_iter': it + 1, 'residual': Fnorm}
+
+def init_budget(vn_list, nt, dt, V_top, V_bot, Qr, Qin, Qout, nsave=10):
+    """
+    Initialize a budget recorder for a box model run of nt steps of dt [s],
+    saving every nsave steps. All the time series are preallocated numpy
+    arrays, (number of saves, number of tracers), filled in by save_budget(),
+    and the DataFrames are only made at the end by finish_budget().
+    """
+    NS = len(range(0, nt, nsave))
+    NV = len(vn_list)
+    bud = dict()
+    bud['vn_list'] = list(vn_list)
+    bud['nsave'] = nsave
+    bud['dt'] = dt
+    bud['V_top'] = V_top
+    bud['V_bot'] = V_bot
+    bud['V'] = np.sum(V_top) + np.sum(V_bot[1:])
+    bud['Qr'] = Qr
+    bud['Qin'] = Qin
+    bud['Qout'] = Qout
+    bud['tt'] = np.arange(NS) * nsave * dt / 86400 # time [days]
+    for k in ['Cnet', 'Fr', 'Fin', 'Fout', 'Cmean_top', 'Cmean_bot']:
+        bud[k] = np.nan * np.ones((NS, NV))
+    return bud
+
+def save_budget(bud, ii, vn, C_top, C_bot, C_river, C_ocean):
+    """
+    Save the budget terms for step ii, if it is a save step. Pass vn = None
+    with (ntracer, N_boxes) stacks to save all the tracers at once, in the
+    order of bud['vn_list'].
+    """
+    if np.mod(ii, bud['nsave']) != 0:
+        return
+    it = ii // bud['nsave']
+    if vn is None:
+        jj = slice(None)
+    else:
+        jj = bud['vn_list'].index(vn)
+    bud['Cnet'][it, jj] = (np.nansum(C_top*bud['V_top'], axis=-1)
+        + np.nansum(C_bot*bud['V_bot'], axis=-1))
+    bud['Fr'][it, jj] = np.atleast_1d(C_river)[..., 0] * bud['Qr']
+    bud['Fin'][it, jj] = np.atleast_1d(C_ocean)[..., 0] * bud['Qin'][-1]
+    bud['Fout'][it, jj] = -(C_top[..., -1] * bud['Qout'][-1])
+    bud['Cmean_top'][it, jj] = np.mean(C_top, axis=-1)
+    bud['Cmean_bot'][it, jj] = np.nanmean(C_bot, axis=-1)
+
+def finish_budget(bud):
+    """
+    Make the DataFrames from a budget recorder. Returns budget_dict, with a
+    DataFrame for each tracer having columns
+    ['Cnet','Cmean','Fr','Fin','Fout','dCnet_dt','Error'], and
+    df_mean_top and df_mean_bot with the layer-mean time series, all indexed
+    by time [days].
+    """
+    tt = bud['tt']
+    Cnet = bud['Cnet']
+    dCnet_dt = np.nan * np.ones(Cnet.shape)
+    tt_sec = tt * 86400
+    dCnet_dt[1:-1,:] = (Cnet[2:,:] - Cnet[:-2,:]) / (tt_sec[2:] - tt_sec[:-2]).reshape(-1,1)
+    Error = dCnet_dt - (bud['Fr'] + bud['Fin'] + bud['Fout'])
+    Cmean = Cnet / bud['V']
+    budget_dict = dict()
+    for jj, vn in enumerate(bud['vn_list']):
+        budget_dict[vn] = pd.DataFrame(index=tt, data={'Cnet':Cnet[:,jj],
+            'Cmean':Cmean[:,jj], 'Fr':bud['Fr'][:,jj], 'Fin':bud['Fin'][:,jj],
+            'Fout':bud['Fout'][:,jj], 'dCnet_dt':dCnet_dt[:,jj], 'Error':Error[:,jj]})
+    df_mean_top = pd.DataFrame(index=tt, columns=bud['vn_list'], data=bud['Cmean_top'])
+    df_mean_bot = pd.DataFrame(index=tt, columns=bud['vn_list'], data=bud['Cmean_bot'])
+    return budget_dict, df_mean_top, df_mean_bot
+
+def get_npzd_bc(vn_list, source, sink_fac, Q_sink):
+    """
+    Boundary values and sinking for each NPZD variable, as stacks in the order
+    of vn_list: C_river and C_ocean (ntracer, 1), and QQ_sink
+    (ntracer, N_boxes) [m3 s-1]. The single nitrogen source is NO3 from
+    the river or the ocean, and SDet and LDet sink at sink_fac/10 and
+    sink_fac times Q_sink.
+    """
+    NV = len(vn_list)
+    C_river = np.zeros((NV,1))
+    C_ocean = np.zeros((NV,1))
+    QQ_sink = np.zeros((NV,len(Q_sink)))
+    for jj, vn in enumerate(vn_list):
+        if vn == 'NO3':
+            if source == 'river':
+                source_str = 'River N Source'
+                C_river[jj] = 10
+            elif source == 'ocean':
+                source_str = 'Ocean N Source'
+                C_ocean[jj] = 10
+            else:
+                print('Error: Check source definition.')
+                sys.exit()
+        elif vn == 'oxy':
+            C_river[jj] = 300
+            C_ocean[jj] = 100
+        if vn == 'SDet':
+            QQ_sink[jj] = sink_fac * Q_sink/10
+        elif vn == 'LDet':
+            QQ_sink[jj] = sink_fac * Q_sink
+    return C_river, C_ocean, QQ_sink, source_str
+
+def run_npzd(sink_fac=4, source='river', etype='chatwin', n_flush=100, E=100,
+    implicit=False, dt_fac=10, verbose=False):
+    """
+    Run the efflux-reflux model with NPZD variables for n_flush flushing
+    times. This is the model of npzd0.py, and has no side effects, so it can
+    be used by scans in a process pool.
+
+    E is the PAR for the upper layer [W m-2]. Set implicit = True to use
+    box_model_implicit() with a time step dt_fac times the explicit one.
+
+    Returns a dict with the final C_top and C_bot stacks (ntracer, N_boxes)
+    in the order of vn_list, the budget and layer-mean DataFrames from
+    finish_budget(), and some of the physical solution.
+    """
+    # create the physical solution
+    phys_tup, sol_tup, er1_tup, er2_tup, er3_tup, t_tup = get_params(etype=etype)
+    # unpacking
+    Qr, B, H_top, H_bot, Sbar_0, DS_0, N_boxes, L, etype = phys_tup
+    Sin, Sout, Qin, Qout, x, DS, dx, DA, X, xb, XB, V_top, V_bot, V = sol_tup
+    alpha_efflux, alpha_reflux = er1_tup
+    Q_efflux_alt, Q_reflux_alt, W_efflux_alt, W_reflux_alt, Net_efflux_alt, Net_reflux_alt = er3_tup
+    dt, T_flush = t_tup
+    if implicit:
+        dt = dt_fac * dt
+
+    # Run for a specified number of flushing times
+    nt = n_flush * int(T_flush / dt)
+    dt_days = dt/86400 # used by npzde.update_v()
+
+    # Form an average for scaling of sinking
+    W_er = (W_efflux_alt.mean() + W_reflux_alt.mean())/2 # [m s-1]
+    Q_sink = W_er * DA
+
+    if verbose:
+        sink_dist = dt * sink_fac * W_er
+        # sinking distance in one time step (must be less than layer thickness) [m]
+        print('dt_days = %0.2f, nt = %d, total time in days = %0.1f' % (dt_days, nt, nt * dt / 86400))
+        print('W_er = %0.2f, sink_fac*W_er %0.2f [m d-1]' % (W_er*86400, sink_fac*W_er*86400))
+        print('H_top = %0.1f, H_bot = %0.1f, sink_dist = %0.1f [m]' % (H_top,H_bot,sink_dist))
+
+    # NPZD model
+    # Note that the time is always in units of days for the NPZD model, whereas
+    # time is seconds for the physical circulation.
+    #
+    # intial conditions, all [mmol N m-3] which is the same as [uM]
+    vn_list = ['Phy', 'Zoo', 'SDet', 'LDet', 'NO3', 'NH4', 'oxy']
+    NV = len(vn_list)
+    C_top = np.zeros((NV,N_boxes))
+    C_top[vn_list.index('Phy')] = 0.01
+    C_top[vn_list.index('Zoo')] = 0.001
+    C_top[vn_list.index('oxy')] = 300 # [mmol O2 m-3]
+    C_bot = C_top.copy()
+
+    # Boundary values and sinking for each variable. The variables are all
+    # advected together as (ntracer, N_boxes) stacks.
+    C_river, C_ocean, QQ_sink, source_str = get_npzd_bc(vn_list, source, sink_fac, Q_sink)
+    iS = vn_list.index('SDet')
+    iL = vn_list.index('LDet')
+    iN = vn_list.index('NH4')
+    iO = vn_list.index('oxy')
+
+    if implicit:
+        # Factor the implicit advection step once for each sinking rate, and
+        # share it among all the tracers that have that rate.
+        solver_list = []
+        for jj in [[iS], [iL], [item for item in range(NV) if item not in [iS, iL]]]:
+            solver = get_solver(alpha_efflux, alpha_reflux, V_top, V_bot,
+                dt, Qin, Qout, Q_sink=QQ_sink[jj[0]])
+            solver_list.append((solver, jj))
+
+    # initialize a recorder to hold budget and layer-mean time series for
+    # each NPZD variable
+    bud = init_budget(vn_list, nt, dt, V_top, V_bot, Qr, Qin, Qout)
+
+    for ii in range(nt):
+
+        # vertical flux due to sinking
+        cff = QQ_sink * dt / V_bot
+        if implicit:
+            # backward-implicit form, so the long time step cannot
+            # remove more than is in the bottom box
+            cff = cff / (1 + cff)
+        S_sink = C_bot[iS] * cff[iS]
+        L_sink = C_bot[iL] * cff[iL]
+        Oxy_air_flux_sum = npzde.airsea_oxygen(C_top[iO], dt_days, DA)
+        DO_change = Oxy_air_flux_sum / V_top
+
+        save_budget(bud, ii, None, C_top, C_bot, C_river, C_ocean)
+
+        # advection step, all variables at once
+        if implicit:
+            for solver, jj in solver_list:
+                C_bot[jj], C_top[jj] = box_model_implicit(C_bot[jj], C_top[jj],
+                    C_river[jj], C_ocean[jj], solver)
+        else:
+            C_bot, C_top = box_model(C_bot, C_top, C_river, C_ocean,
+             alpha_efflux, alpha_reflux, V_top, V_bot, dt, Qin, Qout, Q_sink=QQ_sink)
+
+        # npzd step
+        v_top = npzde.update_v(dict(zip(vn_list, C_top)), E, dt_days)
+        v_bot = npzde.update_v(dict(zip(vn_list, C_bot)), 0, dt_days)
+        C_top = np.array([v_top[vn] for vn in vn_list])
+        C_bot = np.array([v_bot[vn] for vn in vn_list])
+        # account for benthic remineralization
+        C_bot[iS] -= S_sink
+        C_bot[iL] -= L_sink
+        C_bot[iN] += S_sink + L_sink
+        C_bot[iO] -= (106/16) * (S_sink + L_sink)
+        # account for air-sea oxygen transport
+        C_top[iO] += DO_change
+
+    budget_dict, df_mean_top, df_mean_bot = finish_budget(bud)
+
+    out = dict()
+    out['vn_list'] = vn_list
+    out['C_top'] = C_top
+    out['C_bot'] = C_bot
+    out['budget_dict'] = budget_dict
+    out['df_mean_top'] = df_mean_top
+    out['df_mean_bot'] = df_mean_bot
+    out['source_str'] = source_str
+    out['X'] = X
+    out['XB'] = XB
+    out['V_top'] = V_top
+    out['V_bot'] = V_bot
+    out['T_flush'] = T_flush
+    return out
+
+def scan_one(task):
+    """
+    Run one case of a scan, for use with a process pool. task is a tuple of
+    (run number, dict of arguments for run_npzd()). Returns the run number and
+    a tidy DataFrame of the final fields, with one row for each variable,
+    layer and active box, and a column for each of the arguments.
+    """
+    ii, kw = task
+    out = run_npzd(**kw)
+    vn_list = out['vn_list']
+    XB = out['XB']
+    df_list = []
+    for layer in ['top', 'bot']:
+        C = out['C_' + layer]
+        df = pd.DataFrame({'vn': np.repeat(vn_list, len(XB)),
+            'x_km': np.tile(XB, len(vn_list)), 'C': C.ravel()})
+        df.insert(0, 'layer', layer)
+        df_list.append(df)
+    df = pd.concat(df_list, ignore_index=True)
+    df = df[np.isfinite(df.C)].reset_index(drop=True) # drop the inactive cell
+    for k in reversed(list(kw.keys())):
+        df.insert(0, k, kw[k])
+    df.insert(0, 'run', ii)
+    return ii, df
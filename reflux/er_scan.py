@@ -0,0 +1,80 @@
+"""
+Run a scan of efflux-reflux NPZD experiments (the model of npzd0.py) across
+a process pool, and save the final along-channel fields of all the runs in
+one tidy table.
+
+Edit scan_dict below to choose the scan. Each key is an argument of
+er_fun.run_npzd() (e.g. 'sink_fac', 'source', 'etype') and the scan is over
+all combinations of the listed values. Arguments that are the same for all
+runs go in base_dict. Note that with the explicit time step sink_fac > 4
+lets LDet sink out of the bottom layer in one step, so for those use
+'implicit': True.
+
+Run from this directory, e.g.
+python er_scan.py > er_scan.log &
+
+The output is a csv file with columns: run, the scanned and base arguments,
+layer (top or bot), vn, x_km, and C, the final concentration. For example
+the layer means are:
+df.groupby(['sink_fac','source','etype','layer','vn']).C.mean()
+"""
+
+import pandas as pd
+import itertools
+import sys
+from time import time
+from multiprocessing import Pool
+from lo_tools import Lfun
+import er_fun
+from importlib import reload
+reload(er_fun)
+
+# ======================================================================
+
+# Choices
+scan_dict = {
+    'sink_fac': [0, 1, 2, 4],
+    'source': ['river', 'ocean'],
+    'etype': ['chatwin', 'hr'],
+    }
+# arguments that are the same for all runs
+base_dict = {'n_flush': 40}
+Nproc = 8 # number of processes in the pool
+out_name = 'er_scan.csv'
+
+# ----------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+    Ldir = Lfun.Lstart()
+    out_dir = Ldir['parent'] / 'LPM_output' / 'reflux'
+    Lfun.make_dir(out_dir)
+    out_fn = out_dir / out_name
+
+    # make the list of tasks, one per combination of scanned values
+    key_list = list(scan_dict.keys())
+    for k in key_list:
+        if k in base_dict.keys():
+            print('Error: ' + k + ' is in both scan_dict and base_dict')
+            sys.exit()
+    task_list = []
+    for ii, val_tup in enumerate(itertools.product(*[scan_dict[k] for k in key_list])):
+        kw = dict(zip(key_list, val_tup))
+        kw.update(base_dict)
+        task_list.append((ii, kw))
+    NR = len(task_list)
+    print('Total number of runs = %d' % (NR))
+
+    tt0 = time()
+    df_dict = dict()
+    with Pool(Nproc) as pool:
+        for ii, df in pool.imap_unordered(er_fun.scan_one, task_list):
+            df_dict[ii] = df
+            print(' %d runs done, %0.1f sec' % (len(df_dict), time()-tt0))
+            sys.stdout.flush()
+
+    # pack the results into one table, in run order
+    df = pd.concat([df_dict[ii] for ii in range(NR)], ignore_index=True)
+    df.to_csv(out_fn, index=False)
+    print('Saved results to ' + str(out_fn))
+    print('Total processing time = %0.2f sec' % (time()-tt0))
@@ -4,7 +4,6 @@ Code to test conservation and accumulation of a sinking tracer.
 
 import numpy as np
 import matplotlib.pyplot as plt
-import pandas as pd
 
 from lo_tools import plotting_functions as pfun
 import er_fun
@@ -25,9 +24,6 @@ dt, T_flush = t_tup
 W_er = (W_efflux_alt.mean() + W_reflux_alt.mean())/2
 Q_sink = 1 * W_er * DA
 
-# initialize a DataFrame to hold budget time series
-df = pd.DataFrame(columns=['Cnet','Cmean','Fr','Fin','Fout','dCnet_dt','Error'])
-
 # Box model integrator
 # Initial condition
 C_top = np.zeros(N_boxes)
@@ -38,26 +34,18 @@ C_river = np.ones(1)
 C_ocean = np.zeros(1)
 # Run for a specified number of flushing times
 nt = 10 * int(T_flush / dt)
+# initialize a recorder to hold budget time series
+bud = er_fun.init_budget(['C'], nt, dt, V_top, V_bot, Qr, Qin, Qout)
 # Integrate over time
 for ii in range (nt):
 
-    if np.mod(ii,10) == 0:
-        tt = ii*dt/86400 # use time in days for the index
-        df.loc[tt,'Cnet'] = np.nansum(C_top*V_top) + np.nansum(C_bot*V_bot)
-        df.loc[tt,'Fr'] = C_river[0] * Qr
-        df.loc[tt,'Fin'] = C_ocean[0] * Qin[-1]
-        df.loc[tt,'Fout'] = -(C_top[-1] * Qout[-1])
+    er_fun.save_budget(bud, ii, 'C', C_top, C_bot, C_river, C_ocean)
 
     C_bot, C_top = er_fun.box_model(C_bot, C_top, C_river, C_ocean,
         alpha_efflux, alpha_reflux, V_top, V_bot, dt, Qin, Qout, Q_sink=Q_sink)
 
-Cnet = df.Cnet.to_numpy()
-tt_sec = df.index.to_numpy()*86400
-dCnet_dt = (Cnet[2:]-Cnet[:-2])/(tt_sec[2:]-tt_sec[:-2])
-df['dCnet_dt'].iloc[1:-1] = dCnet_dt
-df.loc[:,'Error'] = df.dCnet_dt - (df.Fr + df.Fin + df.Fout)
-
-df.Cmean = df.Cnet/V
+budget_dict, df_mean_top, df_mean_bot = er_fun.finish_budget(bud)
+df = budget_dict['C']
 
 # Plotting
 plt.close('all')
@@ -20,7 +20,6 @@ different sinking speeds.
 
 import numpy as np
 import matplotlib.pyplot as plt
-import pandas as pd
 
 from lo_tools import plotting_functions as pfun
 import er_fun
@@ -59,8 +58,8 @@ W_list = [round(item,2) for item in W_list]
 # W_list = [0,7.2,8.02,9.06,10.4,12.21,14.78,18.72,21.6,25.53,40.11,93.6] # Lily's list [m d-1]
 for W in W_list:
 
-    # initialize a DataFrame to hold budget time series
-    df = pd.DataFrame(columns=['Cnet','Cmean','Fr','Fin','Fout','dCnet_dt','Error'])
+    # initialize a recorder to hold budget time series
+    bud = er_fun.init_budget(['C'], nt, dt, V_top, V_bot, Qr, Qin, Qout)
 
     Q_sink = W * DA / 86400 # convert W from [m d-1] to [m s-1]
     if True:
@@ -75,27 +74,14 @@ for W in W_list:
     C_bot = np.zeros(N_boxes)
     for ii in range (nt):
 
-        if np.mod(ii,10) == 0:
-            tt = ii*dt/86400 # use time in days for the index
-            df.loc[tt,'Cnet'] = np.nansum(C_top*V_top) + np.nansum(C_bot*V_bot)
-            df.loc[tt,'Fr'] = C_river[0] * Qr
-            df.loc[tt,'Fin'] = C_ocean[0] * Qin[-1]
-            df.loc[tt,'Fout'] = -(C_top[-1] * Qout[-1])
+        er_fun.save_budget(bud, ii, 'C', C_top, C_bot, C_river, C_ocean)
 
         C_bot, C_top = er_fun.box_model(C_bot, C_top, C_river, C_ocean, alpha_efflux, alpha_reflux, V_top, V_bot, dt, Qin, Qout, Q_sink=Q_sink)
 
     C_bot_dict[W] = C_bot
     C_top_dict[W] = C_top
 
-    Cnet = df.Cnet.to_numpy()
-    tt_sec = df.index.to_numpy()*86400
-    dCnet_dt = (Cnet[2:]-Cnet[:-2])/(tt_sec[2:]-tt_sec[:-2])
-    df['dCnet_dt'].iloc[1:-1] = dCnet_dt
-    df.loc[:,'Error'] = df.dCnet_dt - (df.Fr + df.Fin + df.Fout)
-
-    df.Cmean = df.Cnet/V
-
-    budget_dict[W] = df
+    budget_dict[W] = er_fun.finish_budget(bud)[0]['C']
     
     print('W=%0.2f, W*dt/H_top=%0.2f, C_bot[1]=%0.2f' %
         (W,(W*dt/86400)/H_top, C_bot[1]))
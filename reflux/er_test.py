@@ -41,6 +41,16 @@ Q_efflux, Q_reflux, W_efflux, W_reflux, Net_efflux, Net_reflux = er2_tup
 Q_efflux_alt, Q_reflux_alt, W_efflux_alt, W_reflux_alt, Net_efflux_alt, Net_reflux_alt = er3_tup
 dt, T_flush = t_tup
 
+# Time stepping: the explicit box_model() is limited to the dt from get_params(),
+# whereas box_model_implicit() can use a time step dt_fac times larger and
+# reaches the same steady state. The explicit run is the reference, so set
+# implicit = True to try the larger time step.
+implicit = False
+dt_fac = 10
+if implicit:
+    dt = dt_fac * dt
+    solver = er_fun.get_solver(alpha_efflux, alpha_reflux, V_top, V_bot, dt, Qin, Qout)
+
 # Box model integrator
 # Initial condition
 C_top = np.zeros(N_boxes)
@@ -53,8 +63,11 @@ C_ocean = Sin[-1]*np.ones(1)
 nt = 10 * int(T_flush / dt)
 # Integrate over time
 for ii in range (nt):
-    C_bot, C_top = er_fun.box_model(C_bot, C_top, C_river, C_ocean,
-        alpha_efflux, alpha_reflux, V_top, V_bot, dt, Qin, Qout)
+    if implicit:
+        C_bot, C_top = er_fun.box_model_implicit(C_bot, C_top, C_river, C_ocean, solver)
+    else:
+        C_bot, C_top = er_fun.box_model(C_bot, C_top, C_river, C_ocean,
+            alpha_efflux, alpha_reflux, V_top, V_bot, dt, Qin, Qout)
 
 # Plotting
 plt.close('all')
@@ -83,6 +83,18 @@ def update_v(v, E, dt):
         
     return v
 
+def get_rates(v, E, dt=1e-3):
+    """
+    Net rate of change of each variable [per day] due to the NPZD processes,
+    found as the change over one short update_v() step of dt [d]. This gives
+    the reaction terms for the steady solver er_fun.steady_newton().
+    """
+    v1 = update_v(v.copy(), E, dt)
+    r = dict()
+    for vn in v.keys():
+        r[vn] = (v1[vn] - v[vn]) / dt
+    return r
+
 def airsea_oxygen(Oxy_surf, dtdays, DA, Uwind=5, Vwind=5, temp_surf=10, salt_surf=25):
     """
     Adapted from:
@@ -0,0 +1,140 @@
+"""
+Code to find the steady state of the efflux-reflux model with NPZD variables
+directly, using a Newton solver, instead of integrating npzd0.py for
+100 flushing times.
+
+The physics, boundary conditions, sinking, benthic remineralization, and
+air-sea oxygen flux are the same as in npzd0.py.
+
+RESULT: For the default choices this converges in about 10 iterations
+(0.1 sec). Compared to the end of a 100 flushing time npzd0.py run with the
+default (explicit) time step the top layer differs by up to 31% for Phy, 23%
+for NO3, and 59% for NH4 (layer means differ by 8%, 23%, and 45%). This is
+the splitting error of the time stepping in npzd0.py, not of this solver:
+it is about halved each time the npzd0.py time step is halved, e.g. with
+implicit = True and dt_fac = 0.25 the differences are 6%, 5%, and 17%
+(layer means 1%, 5%, and 17%).
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+import pandas as pd
+from time import time
+
+from lo_tools import plotting_functions as pfun
+import er_fun
+import npzd_equations as npzde
+from importlib import reload
+reload(er_fun)
+reload(npzde)
+
+# ======================================================================
+
+# Choices
+sink_fac = 4
+source = 'river' # river or ocean
+etype = 'chatwin' # chatwin or hr
+
+# ----------------------------------------------------------------------
+
+# create the physical solution
+phys_tup, sol_tup, er1_tup, er2_tup, er3_tup, t_tup = er_fun.get_params(etype=etype)
+# unpacking
+Qr, B, H_top, H_bot, Sbar_0, DS_0, N_boxes, L, etype = phys_tup
+Sin, Sout, Qin, Qout, x, DS, dx, DA, X, xb, XB, V_top, V_bot, V = sol_tup
+alpha_efflux, alpha_reflux = er1_tup
+Q_efflux, Q_reflux, W_efflux, W_reflux, Net_efflux, Net_reflux = er2_tup
+Q_efflux_alt, Q_reflux_alt, W_efflux_alt, W_reflux_alt, Net_efflux_alt, Net_reflux_alt = er3_tup
+dt, T_flush = t_tup
+
+# Form an average for scaling of sinking
+W_er = (W_efflux_alt.mean() + W_reflux_alt.mean())/2 # [m s-1]
+Q_sink = W_er * DA
+
+vn_list = ['Phy', 'Zoo', 'SDet', 'LDet', 'NO3', 'NH4', 'oxy']
+E = 100 # PAR for upper layer [W m-2]
+
+# boundary values and sinking for each variable
+C_river, C_ocean, QQ_sink, source_str = er_fun.get_npzd_bc(vn_list, source, sink_fac, Q_sink)
+
+A_list = []
+b_river_list = []
+b_ocean_list = []
+for ii, vn in enumerate(vn_list):
+    A, b_river, b_ocean = er_fun.get_A(alpha_efflux, alpha_reflux, V_top, V_bot,
+        Qin, Qout, Q_sink=QQ_sink[ii])
+    A_list.append(A)
+    b_river_list.append(b_river)
+    b_ocean_list.append(b_ocean)
+
+iS = vn_list.index('SDet')
+iL = vn_list.index('LDet')
+iN = vn_list.index('NH4')
+iO = vn_list.index('oxy')
+def rate_fun(C_top, C_bot):
+    """
+    Local source and sink terms [uM s-1] for both layers.
+    """
+    r_top = npzde.get_rates(dict(zip(vn_list, C_top)), E)
+    r_bot = npzde.get_rates(dict(zip(vn_list, C_bot)), 0)
+    R_top = np.array([r_top[vn] for vn in vn_list])
+    R_bot = np.array([r_bot[vn] for vn in vn_list])
+    # account for benthic remineralization [uM d-1]
+    S_sink = C_bot[iS] * QQ_sink[iS] * 86400 / V_bot
+    L_sink = C_bot[iL] * QQ_sink[iL] * 86400 / V_bot
+    R_bot[iS] -= S_sink
+    R_bot[iL] -= L_sink
+    R_bot[iN] += S_sink + L_sink
+    R_bot[iO] -= (106/16) * (S_sink + L_sink)
+    # account for air-sea oxygen transport [uM d-1]
+    R_top[iO] += npzde.airsea_oxygen(C_top[iO], 1, DA) / V_top
+    return R_top/86400, R_bot/86400
+
+# Initial guess. Note that starting from the npzd0.py initial condition
+# (Phy = 0.01, Zoo = 0.001) the solver lands on the trivial steady state with
+# no phytoplankton, so we start from something bloom-like instead.
+C_top = np.array([2, 0.2, 1, 0.1, 1, 0.5, 300])[:, None] * np.ones(N_boxes)
+C_bot = C_top.copy()
+
+tt0 = time()
+C_bot, C_top, out = er_fun.steady_newton(C_top, C_bot, C_river, C_ocean,
+    A_list, b_river_list, b_ocean_list, rate_fun, dtau=T_flush/10, verbose=True)
+print('Steady solution: %d iterations, residual = %0.2e, %0.2f sec'
+    % (out['n_iter'], out['residual'], time()-tt0))
+
+df_top = pd.DataFrame(index=XB,columns=vn_list,data=C_top.T)
+df_bot = pd.DataFrame(index=XB,columns=vn_list,data=C_bot.T)
+
+# ======================================================================
+
+plt.close('all')
+pfun.start_plot(figsize=(12,8))
+lw = 3
+vn_list_short = [item for item in vn_list if item != 'oxy']
+
+fig = plt.figure()
+
+ax = fig.add_subplot(211)
+df_top.plot(y=vn_list_short,ax=ax,linewidth=lw)
+ax.set_title(source_str + ' (steady)')
+ax.text(.5,.9,'Top Layer',ha='center',transform=ax.transAxes)
+
+ax = fig.add_subplot(212)
+df_bot.plot(y=vn_list_short,ax=ax,linewidth=lw, legend=False)
+ax.set_xlabel('Along Channel Distance [km]')
+ax.text(.5,.9,'Bottom Layer',ha='center',transform=ax.transAxes)
+
+fig = plt.figure()
+
+ax = fig.add_subplot(211)
+df_top.plot(y=['oxy'],ax=ax,linewidth=lw)
+ax.set_title(source_str + ' (steady)')
+ax.text(.5,.9,'Top Layer',ha='center',transform=ax.transAxes)
+
+ax = fig.add_subplot(212)
+df_bot.plot(y=['oxy'],ax=ax,linewidth=lw, legend=False)
+ax.set_xlabel('Along Channel Distance [km]')
+ax.text(.5,.9,'Bottom Layer',ha='center',transform=ax.transAxes)
+
+pfun.end_plot()
+plt.show()